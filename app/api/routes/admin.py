@@ -0,0 +1,70 @@
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+
+from app.core.config import settings
+from app.services.profiling import ProfilerBusy, cpu_profiler, memory_profiler
+from app.services.vector_store import vector_store_service
+
+router = APIRouter()
+
+async def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    """Dependency that admits only callers presenting ADMIN_TOKEN."""
+    if not settings.ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required.")
+    return True
+
+@router.get("/profile/cpu", response_class=PlainTextResponse)
+async def profile_cpu(
+    seconds: float = Query(default=10.0, gt=0),
+    interval_ms: float = Query(default=10.0, ge=1),
+    include_idle: bool = False,
+    admin: bool = Depends(require_admin)
+):
+    """
+    Sample the stacks of every thread for a number of seconds.
+
+    Returns collapsed stacks, one "frame;frame;... count" line per stack, ready for
+    flamegraph.pl or speedscope.
+    """
+    seconds = min(seconds, settings.PROFILING_MAX_SECONDS)
+    try:
+        return await run_in_threadpool(cpu_profiler.profile, seconds, interval_ms / 1000.0, include_idle)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.post("/profile/memory/snapshot")
+async def memory_snapshot(top: int = Query(default=20, ge=1), admin: bool = Depends(require_admin)):
+    """
+    Take a tracemalloc snapshot, starting tracing on the first call.
+
+    Allocations are broken down by VectorStoreService component. FAISS vectors and SQLite
+    pages are allocated outside Python, so their sizes are reported under "native".
+    """
+    return await run_in_threadpool(memory_profiler.snapshot, vector_store_service, top)
+
+@router.get("/profile/memory/diff")
+async def memory_diff(
+    base: int,
+    target: Optional[int] = None,
+    top: int = Query(default=20, ge=1),
+    admin: bool = Depends(require_admin)
+):
+    """Compare two snapshots (the latest one when target is omitted)."""
+    try:
+        return await run_in_threadpool(memory_profiler.diff, base, target, top)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.get("/profile/memory/snapshots")
+async def memory_snapshots(admin: bool = Depends(require_admin)):
+    return {"snapshots": memory_profiler.snapshots()}
+
+@router.post("/profile/memory/stop")
+async def memory_stop(admin: bool = Depends(require_admin)):
+    """Stop tracing and drop the stored snapshots."""
+    memory_profiler.stop()
+    return {"status": "stopped"}
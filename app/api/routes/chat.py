@@ -1,10 +1,24 @@
-from fastapi import APIRouter, HTTPException, Depends
+import time
+import logging
+import ipaddress
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from typing import List
-from pydantic import BaseModel
+from pydantic import Field
 
-from app.models.chat import ChatRequest, ChatResponse, Message
+from app.core.config import settings
+from app.models.chat import ChatRequest, ChatResponse, Message, RetrievalOptions
 from app.services.vector_store import vector_store_service
+from app.services.query_log import query_log
+from app.services.concurrency import (
+    AdmissionRejected,
+    admission_controller,
+    query_coalescer,
+    query_key,
+    rate_limiter,
+)
 
+logger = logging.getLogger(__name__)
 router = APIRouter()
 
 async def validate_index():
@@ -19,8 +33,114 @@ async def validate_index():
             )
     return True
 
+def _trusted_networks() -> List:
+    networks = []
+    for entry in settings.TRUSTED_PROXIES.split(","):
+        entry = entry.strip()
+        if entry and entry != "*":
+            try:
+                networks.append(ipaddress.ip_network(entry, strict=False))
+            except ValueError:
+                logger.warning(f"Ignoring invalid TRUSTED_PROXIES entry {entry!r}")
+    return networks
+
+def _is_trusted_proxy(address: str, networks: List) -> bool:
+    if settings.TRUSTED_PROXIES.strip() == "*":
+        return True
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+def _client_id(http_request: Request) -> str:
+    """
+    Identify the caller by socket address, or by X-Forwarded-For when the peer is a trusted proxy.
+    
+    The header is read right to left and the first address that is not itself a trusted
+    proxy is used, so a value the client put in front of the chain is never taken.
+    """
+    peer = http_request.client.host if http_request.client else "unknown"
+    forwarded = http_request.headers.get("x-forwarded-for")
+    networks = _trusted_networks()
+    if not forwarded or not _is_trusted_proxy(peer, networks):
+        return peer
+    
+    hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+    if settings.TRUSTED_PROXIES.strip() == "*":
+        # The edge proxy overwrites the header, so its only entry is the client
+        return hops[-1] if hops else peer
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop, networks):
+            return hop
+    return hops[0] if hops else peer
+
+async def rate_limit(http_request: Request):
+    """Dependency that enforces the per-client rate limit."""
+    retry_after = rate_limiter.check(_client_id(http_request))
+    if retry_after:
+        rejection = AdmissionRejected("Rate limit exceeded.", retry_after)
+        raise HTTPException(
+            status_code=429,
+            detail=str(rejection),
+            headers={"Retry-After": str(rejection.retry_after)}
+        )
+    return True
+
+async def run_query(query_text: str, chat_history: List[dict] = None, endpoint: str = "/chat", **options) -> str:
+    """
+    Run a query through admission control, sharing the result with identical queries already in flight.
+    
+    Raises HTTPException 400 when sources are given but the index cannot filter by them,
+    and 429 with a Retry-After header when the query queue is full.
+    The query and its stage timings are captured in the query log when it is enabled.
+    """
+    if options.get("sources") and not vector_store_service.supports_source_filters():
+        raise HTTPException(
+            status_code=400,
+            detail="Filtering by sources needs a sharded index (VECTOR_SHARDING=fixed or document)."
+        )
+    
+    start = time.perf_counter()
+    led = False
+    
+    async def compute():
+        nonlocal led
+        led = True
+        stats = {}
+        async with admission_controller.slot():
+            stats["queue_seconds"] = time.perf_counter() - start
+            response = await run_in_threadpool(vector_store_service.query, query_text, chat_history, stats=stats, **options)
+        return response, stats
+    
+    try:
+        response, stats = await query_coalescer.do(query_key(query_text, chat_history, options), compute)
+    except AdmissionRejected as e:
+        query_log.record(endpoint, query_text, chat_history, options, "rejected", time.perf_counter() - start)
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    
+    query_log.record(
+        endpoint,
+        query_text,
+        chat_history,
+        options,
+        stats.get("status", "ok"),
+        time.perf_counter() - start,
+        stages=stats,
+        coalesced=not led
+    )
+    return response
+
 @router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest, index_loaded: bool = Depends(validate_index)):
+async def chat(
+    request: ChatRequest,
+    index_loaded: bool = Depends(validate_index),
+    admitted: bool = Depends(rate_limit)
+):
     """
     Chat with the RAG system.
     
@@ -37,7 +157,14 @@ async def chat(request: ChatRequest, index_loaded: bool = Depends(validate_index
                 })
         
         # Query the index
-        response = vector_store_service.query(request.query, chat_history)
+        response = await run_query(
+            request.query,
+            chat_history,
+            top_k=request.top_k,
+            candidate_pool=request.candidate_pool,
+            token_budget=request.token_budget,
+            sources=request.sources
+        )
         
         # For now, we don't have a way to extract sources from the response
         # In a more advanced implementation, we could parse the response to extract sources
@@ -45,14 +172,20 @@ async def chat(request: ChatRequest, index_loaded: bool = Depends(validate_index
             response=response,
             sources=[]
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error querying the index: {str(e)}")
 
-class SimpleQuery(BaseModel):
-    query: str
+class SimpleQuery(RetrievalOptions):
+    query: str = Field(..., description="User query/question")
 
 @router.post("/chat/simple", response_model=ChatResponse)
-async def simple_chat(query_data: SimpleQuery, index_loaded: bool = Depends(validate_index)):
+async def simple_chat(
+    query_data: SimpleQuery,
+    index_loaded: bool = Depends(validate_index),
+    admitted: bool = Depends(rate_limit)
+):
     """
     Simple chat endpoint that doesn't require chat history.
     
@@ -60,11 +193,20 @@ async def simple_chat(query_data: SimpleQuery, index_loaded: bool = Depends(vali
     """
     try:
         # Query the index
-        response = vector_store_service.query(query_data.query)
+        response = await run_query(
+            query_data.query,
+            endpoint="/chat/simple",
+            top_k=query_data.top_k,
+            candidate_pool=query_data.candidate_pool,
+            token_budget=query_data.token_budget,
+            sources=query_data.sources
+        )
         
         return ChatResponse(
             response=response,
             sources=[]
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error querying the index: {str(e)}")
@@ -12,6 +12,8 @@ router = APIRouter()
 @router.get("/status", response_model=IndexResponse)
 async def get_index_status():
     """Check if the index exists."""
+    ingestion = vector_store_service.ingestion_status()
+    
     # Check if vector index exists
     if vector_store_service.is_index_loaded():
         # Count documents in data folder
@@ -19,11 +21,15 @@ async def get_index_status():
         return IndexResponse(
             status="success",
             message="Vector index is loaded and ready for queries.",
-            document_count=len(pdf_files)
+            document_count=len(pdf_files),
+            retried_nodes=ingestion["retried_nodes"],
+            failed_nodes=ingestion["failed_nodes"]
         )
     else:
         return IndexResponse(
             status="error",
             message="Vector index is not loaded. Please wait for the system to initialize.",
-            document_count=0
+            document_count=0,
+            retried_nodes=ingestion["retried_nodes"],
+            failed_nodes=ingestion["failed_nodes"]
         )
@@ -23,10 +23,99 @@ class Settings(BaseModel):
     # Vector DB
     EMBEDDING_DIMENSION: int = 768
     VECTOR_DB_PATH: str = "vector_db"
+    # Only load a prebuilt index (see `python -m app.ingest`); never build one in the server process
+    INDEX_LOAD_ONLY: bool = os.getenv("INDEX_LOAD_ONLY", "false").lower() in ("1", "true", "yes")
+    DOCSTORE_BACKEND: str = os.getenv("DOCSTORE_BACKEND", "sqlite")  # "sqlite" keeps node text on disk, "memory" keeps it in the pickled index
+    DOCSTORE_CACHE_SIZE: int = 256  # Hot nodes kept in memory by the SQLite docstore
+    
+    # Vector sharding: "none" (one FAISS index), "document" (one shard per PDF) or "fixed" (VECTOR_SHARD_COUNT hash buckets)
+    VECTOR_SHARDING: str = os.getenv("VECTOR_SHARDING", "fixed")
+    VECTOR_SHARD_COUNT: int = 8
+    SHARD_SEARCH_THREADS: int = os.cpu_count() or 4
+    PARALLEL_SEARCH_MIN_VECTORS: int = 20000  # Below this, shards are searched inline
     
     # Data
     DATA_DIR: str = "data"
     
+    # Index building: nodes per embedding batch, and retries before a node is dead-lettered
+    INGEST_BATCH_SIZE: int = 10
+    INGEST_MAX_ATTEMPTS: int = 5
+    INGEST_BACKOFF_BASE_SECONDS: float = 1.0
+    INGEST_BACKOFF_MAX_SECONDS: float = 30.0
+    
+    # Cache of PDF-to-markdown extraction, keyed by file and page content hashes
+    EXTRACTION_CACHE_ENABLED: bool = True
+    EXTRACTION_CACHE_DIR: str = ".extraction_cache"
+    
+    # Chunking
+    CHUNK_SIZE: int = 512
+    CHUNK_OVERLAP: int = 50
+    
+    # Near-duplicate chunk removal before embedding
+    DEDUP_ENABLED: bool = True
+    DEDUP_THRESHOLD: float = 0.9
+    DEDUP_NUM_PERM: int = 128
+    DEDUP_SHINGLE_SIZE: int = 5
+    
+    # Retrieval: over-fetch candidates, diversify with MMR, pack into a token budget
+    RETRIEVAL_TOP_K: int = 2  # Same as the previous query engine (llama-index's default similarity_top_k)
+    RETRIEVAL_CANDIDATE_POOL: int = 20
+    MMR_LAMBDA: float = 0.7
+    CONTEXT_TOKEN_BUDGET: int = 1500
+    # Upper bounds on the per-request overrides; MMR compares every pair of candidates
+    MAX_RETRIEVAL_TOP_K: int = 20
+    MAX_RETRIEVAL_CANDIDATE_POOL: int = 200
+    MAX_CONTEXT_TOKEN_BUDGET: int = 8000
+    SYNTHESIS_LATENCY_WINDOW: int = 100  # Recent queries used to estimate synthesis seconds per context token
+    
+    # Admission control for chat queries
+    MAX_CONCURRENT_QUERIES: int = 4
+    MAX_QUEUED_QUERIES: int = 32
+    QUEUE_TIMEOUT_SECONDS: float = 30.0
+    RATE_LIMIT_PER_MINUTE: float = 30.0  # Per client; 0 disables rate limiting
+    RATE_LIMIT_BURST: int = 10
+    # Peers whose X-Forwarded-For header is trusted: comma-separated IPs or CIDRs, "*" for any (behind Vercel's edge,
+    # which overwrites the header). Empty means clients are identified by their socket address only.
+    TRUSTED_PROXIES: str = os.getenv("TRUSTED_PROXIES", "")
+    
+    # LLM provider routing
+    LLM_DEADLINE_SECONDS: float = 60.0  # Per query, including retrieval
+    HEDGE_AFTER_SECONDS: float = 8.0  # 0 disables hedged requests
+    PROVIDER_STATS_WINDOW: int = 50
+    BREAKER_FAILURE_THRESHOLD: int = 3
+    BREAKER_ERROR_RATE: float = 0.5
+    BREAKER_COOLDOWN_SECONDS: float = 30.0
+    
+    # Query embedding micro-batching: concurrent queries share one embedding request
+    EMBED_BATCH_WINDOW_MS: float = 5.0  # How long the first query of a batch waits for others; 0 disables batching
+    EMBED_MAX_BATCH_SIZE: int = 32
+    EMBED_MAX_CONCURRENT_BATCHES: int = 4
+    
+    # Query caches: embeddings of recent queries, and answers to history-free queries.
+    # Cached answers can be stale until they expire, so the answer cache is opt-in.
+    EMBEDDING_CACHE_SIZE: int = 1024
+    ANSWER_CACHE_ENABLED: bool = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+    ANSWER_CACHE_SIZE: int = 256
+    ANSWER_CACHE_TTL_SECONDS: float = 3600.0
+    
+    # Query log capture: "redacted" masks emails, phone numbers and the like, "hash" keeps no text, "full" keeps it verbatim
+    QUERY_LOG_ENABLED: bool = os.getenv("QUERY_LOG_ENABLED", "false").lower() in ("1", "true", "yes")
+    QUERY_LOG_PATH: str = os.getenv("QUERY_LOG_PATH", "query_log.jsonl")
+    QUERY_LOG_MODE: str = os.getenv("QUERY_LOG_MODE", "redacted")
+    # Pre-warm the caches at startup from the most frequent logged queries; 0 disables
+    QUERY_WARMUP_QUERIES: int = int(os.getenv("QUERY_WARMUP_QUERIES", "0"))
+    QUERY_WARMUP_ANSWERS: bool = False  # Also answer them through the LLM to fill the answer cache, when enabled
+    
+    # Admin profiling endpoints (/admin/profile/...); mounted only when enabled, and every call needs ADMIN_TOKEN
+    PROFILING_ENABLED: bool = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+    PROFILING_MAX_SECONDS: float = 60.0
+    PROFILING_MAX_SNAPSHOTS: int = 5
+    PROFILING_TRACEBACK_FRAMES: int = 25
+    # Trace allocations from startup, so memory held since the index was loaded is attributed too.
+    # Every import is traced as well, which makes startup many times slower.
+    PROFILING_TRACE_AT_STARTUP: bool = os.getenv("PROFILING_TRACE_AT_STARTUP", "false").lower() in ("1", "true", "yes")
+    
     # System prompt for the chatbot
     SYSTEM_PROMPT: str = """
     # ConnectSense: South Asian Public Sector Network Planning Assistant - System Prompt
@@ -0,0 +1,274 @@
+"""
+Build the vector index offline and write it as a deployable artifact.
+
+The artifact directory holds the pickled index, the docstore and a manifest.json that
+records the embedding model, dimension, chunking parameters, the corpus (file names,
+sizes and hashes) and a checksum for every file. The server verifies the manifest on
+load; run it with INDEX_LOAD_ONLY=true so it never builds an index itself.
+
+Usage:
+    python -m app.ingest [--data-dir data] [--output vector_db] [--workers N] [--force]
+    python -m app.ingest --redrive    # retry nodes that failed to embed in the last build
+    python -m app.ingest --resume     # finish a build the server started and was interrupted
+    python -m app.ingest --rebuild-shard shard-003    # re-index one shard from the data folder
+"""
+
+import os
+import json
+import glob
+import time
+import shutil
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional
+
+from llama_index.core import Document, StorageContext, VectorStoreIndex
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+
+from app.core.config import settings
+from app.services.artifact import build_settings, corpus_manifest, read_manifest, write_manifest
+from app.services.docstore import SQLiteDocumentStore
+from app.services.extraction_cache import EXTRACTOR_VERSION, extract_markdown
+from app.services.ingestion import DeadLetterQueue, IngestionState, embed_with_retry
+from app.services.vector_store import VectorStoreService
+
+logger = logging.getLogger(__name__)
+
+# Corpus and settings of the build in a staging directory, so only a matching build is resumed
+STAGING_BUILD_FILENAME = "staging_build.json"
+
+
+def extract_documents(pdf_files: List[str], workers: int) -> List[Document]:
+    """Convert PDFs to markdown in parallel worker processes."""
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        texts = list(executor.map(extract_markdown, pdf_files))
+
+    documents = []
+    for file_path, text in zip(pdf_files, texts):
+        if text:
+            documents.append(Document(
+                id_=os.path.basename(file_path),
+                text=text,
+                metadata={"filename": os.path.basename(file_path)},
+            ))
+        else:
+            logger.warning(f"No text extracted from {file_path}")
+    return documents
+
+
+def embed_nodes(service: VectorStoreService, nodes: List[BaseNode], workers: int, batch_size: int, state: IngestionState, dead_letters: DeadLetterQueue, path: str):
+    """
+    Embed nodes in batches on a thread pool with retries.
+
+    Each batch is inserted into the service's index and saved to path as it completes, as
+    the service does for in-process builds, so an interrupted build resumes where it stopped.
+    Workers only embed; state is updated on this thread as their results come in.
+    """
+    batches = [nodes[i:i + batch_size] for i in range(0, len(nodes), batch_size)]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda batch: embed_with_retry(batch, service.embed_model), batches)
+        for done, (succeeded, failed, retried) in enumerate(results, start=1):
+            state.retried_nodes += retried
+            if succeeded:
+                # Nodes already carry their embeddings, so inserting makes no embedding calls
+                service.index.insert_nodes(succeeded)
+                state.indexed_nodes += len(succeeded)
+            for node, error in failed:
+                logger.error(f"Node {node.node_id} from {node.metadata.get('filename', 'unknown')} failed: {error}")
+                dead_letters.add(node, error, settings.INGEST_MAX_ATTEMPTS)
+                state.failed_nodes += 1
+            if not service.save_index(path):
+                raise SystemExit("Failed to save the index")
+            state.save()
+            logger.info(f"Embedded batch {done}/{len(batches)}")
+
+
+def _staging_matches(staging: str, build: dict) -> bool:
+    """Whether staging holds an interrupted build of the same corpus with the same settings."""
+    build_path = os.path.join(staging, STAGING_BUILD_FILENAME)
+    if IngestionState(staging).status != "in_progress" or not os.path.exists(build_path):
+        return False
+    with open(build_path) as f:
+        return json.load(f) == build
+
+
+def build_artifact(data_dir: str, output: str, workers: int, embed_workers: int, embed_batch_size: int, force: bool = False) -> dict:
+    """
+    Build the index from data_dir into a staging directory and swap it into place.
+
+    An interrupted build of the same corpus and settings is resumed from the staging
+    directory without re-embedding the nodes it already saved.
+    """
+    start = time.time()
+    pdf_files = sorted(glob.glob(os.path.join(data_dir, "*.pdf")))
+    if not pdf_files:
+        raise SystemExit(f"No PDF files found in {data_dir}")
+
+    corpus = corpus_manifest(pdf_files)
+    existing = read_manifest(output)
+    if existing and not force and existing.get("corpus") == corpus and existing.get("extractor") == EXTRACTOR_VERSION and all(
+        existing.get(key) == value for key, value in build_settings().items()
+    ):
+        logger.info(f"Artifact {existing['version']} in {output} is up to date; use --force to rebuild")
+        return existing
+
+    service = VectorStoreService(serving=False)
+    staging = f"{output.rstrip(os.sep)}.staging"
+    build = {"corpus": corpus, "extractor": EXTRACTOR_VERSION, **build_settings()}
+    if _staging_matches(staging, build) and service.load_index(staging, read_only=False) is not None:
+        state = IngestionState(staging)
+        logger.info(f"Resuming the interrupted build in {staging} ({state.indexed_nodes} nodes already indexed)")
+    else:
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        with open(os.path.join(staging, STAGING_BUILD_FILENAME), "w") as f:
+            json.dump(build, f)
+
+        vector_store = service.create_vector_store()
+        if settings.DOCSTORE_BACKEND == "sqlite":
+            docstore = SQLiteDocumentStore(os.path.join(staging, "docstore.sqlite"))
+        else:
+            docstore = SimpleDocumentStore()
+        storage_context = StorageContext.from_defaults(vector_store=vector_store, docstore=docstore)
+        service.index = VectorStoreIndex(nodes=[], storage_context=storage_context)
+        service.vector_store = vector_store
+        state = IngestionState(staging)
+        state.status = "in_progress"
+        state.save()
+    dead_letters = DeadLetterQueue(staging)
+
+    logger.info(f"Extracting {len(pdf_files)} PDFs with {workers} workers...")
+    documents = extract_documents(pdf_files, workers)
+    nodes = service.split_documents(documents)
+
+    done_ids = service.indexed_node_ids() | {node.node_id for node in dead_letters.load()}
+    pending = [node for node in nodes if node.node_id not in done_ids]
+    logger.info(f"Embedding {len(pending)} of {len(nodes)} nodes with {embed_workers} threads...")
+    embed_nodes(service, pending, embed_workers, embed_batch_size, state, dead_letters, staging)
+    state.status = "complete"
+    state.save()
+
+    if not service.save_index(staging):
+        raise SystemExit("Failed to save the index")
+    os.remove(os.path.join(staging, STAGING_BUILD_FILENAME))
+    manifest = finalize_artifact(
+        service,
+        staging,
+        corpus,
+        extra={
+            "extractor": EXTRACTOR_VERSION,
+            "dedup_stats": service.dedup_stats,
+            "build_seconds": round(time.time() - start, 1),
+        },
+    )
+
+    # Keep the previous artifact next to the new one for quick rollback
+    previous = f"{output.rstrip(os.sep)}.previous"
+    if os.path.exists(output):
+        shutil.rmtree(previous, ignore_errors=True)
+        os.rename(output, previous)
+    os.rename(staging, output)
+
+    logger.info(
+        f"Wrote index artifact {manifest['version']} ({state.indexed_nodes} nodes, "
+        f"{state.failed_nodes} dead-lettered) to {output}"
+    )
+    return manifest
+
+
+def finalize_artifact(service: VectorStoreService, path: str, corpus: list, extra: dict) -> dict:
+    """Close the docstore and write the manifest for the index held by the service."""
+    docstore = service.index.docstore
+    if isinstance(docstore, SQLiteDocumentStore):
+        # Folds the write-ahead log into the file before it is checksummed, so it opens on a read-only filesystem
+        docstore.kvstore.seal()
+    return write_manifest(path, corpus, node_count=len(service.index.index_struct.nodes_dict), extra=extra)
+
+
+def redrive(output: str) -> Optional[dict]:
+    """Retry the dead-lettered nodes of an existing index and re-seal it if it is an artifact."""
+    manifest = read_manifest(output)
+    service = VectorStoreService(serving=False)
+    if service.load_index(output, read_only=False) is None:
+        raise SystemExit(f"No loadable index in {output}")
+
+    remaining = service.redrive_dead_letters(output)
+    if not service.save_index(output):
+        raise SystemExit("Failed to save the index")
+    if manifest is None:
+        # Built in-process by the server, so there is no artifact to re-seal
+        logger.info(f"Re-drive finished; {remaining} nodes still dead-lettered")
+        return None
+
+    extra = {k: v for k, v in manifest.items() if k in ("extractor", "dedup_stats", "build_seconds")}
+    manifest = finalize_artifact(service, output, manifest["corpus"], extra)
+    logger.info(f"Re-sealed artifact {manifest['version']}; {remaining} nodes still dead-lettered")
+    return manifest
+
+
+def resume(data_dir: str, output: str):
+    """Finish an index build the server started in-process and was interrupted."""
+    service = VectorStoreService(serving=False)
+    if IngestionState(output).status != "in_progress" or service.load_index(output, read_only=False) is None:
+        raise SystemExit(f"No interrupted build in {output}")
+
+    documents = service.load_documents_from_folder(data_dir)
+    if not documents:
+        raise SystemExit(f"No documents could be read from {data_dir}")
+    service.create_index_in_batches(documents, path=output)
+    state = IngestionState(output)
+    logger.info(f"Build in {output} is {state.status}: {state.indexed_nodes} nodes indexed, {state.failed_nodes} dead-lettered")
+
+
+def rebuild_shard(output: str, key: str) -> dict:
+    """Re-index one shard of an existing artifact from the data folder and re-seal it."""
+    manifest = read_manifest(output)
+    service = VectorStoreService(serving=False)
+    if manifest is None or service.load_index(output, read_only=False) is None:
+        raise SystemExit(f"No loadable index artifact in {output}")
+
+    try:
+        indexed = service.rebuild_shard(key, output)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+    pdf_files = sorted(glob.glob(os.path.join(settings.DATA_DIR, "*.pdf")))
+    extra = {k: v for k, v in manifest.items() if k in ("extractor", "dedup_stats", "build_seconds")}
+    manifest = finalize_artifact(service, output, corpus_manifest(pdf_files), extra)
+    logger.info(f"Rebuilt shard {key} with {indexed} nodes; re-sealed artifact {manifest['version']}")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a deployable vector index artifact from the PDF corpus.")
+    parser.add_argument("--data-dir", default=settings.DATA_DIR, help="Folder containing the PDF documents")
+    parser.add_argument("--output", default=settings.VECTOR_DB_PATH, help="Artifact directory the server loads from")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes used for PDF extraction")
+    parser.add_argument("--embed-workers", type=int, default=4, help="Concurrent embedding requests")
+    parser.add_argument("--embed-batch-size", type=int, default=50, help="Nodes per embedding request")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the artifact matches the corpus")
+    parser.add_argument("--redrive", action="store_true", help="Retry the dead-lettered nodes of the existing index instead of rebuilding")
+    parser.add_argument("--resume", action="store_true", help="Finish an interrupted in-process build of the existing index instead of rebuilding")
+    parser.add_argument("--rebuild-shard", metavar="KEY", help="Re-index one shard of the existing artifact instead of rebuilding")
+    args = parser.parse_args()
+
+    if args.rebuild_shard:
+        rebuild_shard(args.output, args.rebuild_shard)
+        return
+
+    if args.redrive:
+        redrive(args.output)
+        return
+
+    if args.resume:
+        resume(args.data_dir, args.output)
+        return
+
+    build_artifact(args.data_dir, args.output, args.workers, args.embed_workers, args.embed_batch_size, args.force)
+
+
+if __name__ == "__main__":
+    main()
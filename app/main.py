@@ -1,4 +1,5 @@
 import os
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.docs import get_swagger_ui_html
@@ -6,6 +7,12 @@ from fastapi.openapi.utils import get_openapi
 import glob
 
 from app.core.config import settings
+
+if settings.PROFILING_ENABLED and settings.PROFILING_TRACE_AT_STARTUP:
+    # Before the routes import the service, so loading the index is traced too
+    from app.services.profiling import memory_profiler
+    memory_profiler.start()
+
 from app.api.routes import chat, index
 from app.services.vector_store import vector_store_service
 
@@ -29,6 +36,10 @@ app.add_middleware(
 # Include routers
 app.include_router(index.router, prefix="/index", tags=["Index"])
 app.include_router(chat.router, tags=["Chat"])
+if settings.PROFILING_ENABLED:
+    # Not mounted at all unless enabled, so production pays nothing for it
+    from app.api.routes import admin
+    app.include_router(admin.router, prefix="/admin", tags=["Admin"], include_in_schema=False)
 
 # Custom Swagger UI
 @app.get("/docs", include_in_schema=False)
@@ -64,7 +75,9 @@ async def startup_event():
     """Ensure vector index is initialized when the application starts."""
     try:
         # Try to load the index if it exists
-        if not vector_store_service.is_index_loaded():
+        if not vector_store_service.is_index_loaded() and settings.INDEX_LOAD_ONLY:
+            print("INDEX_LOAD_ONLY is set and no index artifact could be loaded. Run `python -m app.ingest` to build one.")
+        elif not vector_store_service.is_index_loaded():
             # If index doesn't exist, try to create it from documents
             documents = vector_store_service.load_documents_from_folder()
             if documents:
@@ -77,6 +90,10 @@ async def startup_event():
             # Count PDF files in data directory
             pdf_files = glob.glob(f"{settings.DATA_DIR}/*.pdf")
             print(f"Vector index initialized. Found {len(pdf_files)} PDF documents in data directory.")
+        
+        if vector_store_service.is_index_loaded() and settings.QUERY_WARMUP_QUERIES > 0:
+            # Warm in the background so startup does not wait on embedding or LLM calls
+            asyncio.get_running_loop().run_in_executor(None, vector_store_service.warm_caches)
     except Exception as e:
         print(f"Error initializing vector index: {str(e)}")
         print("WARNING: Vector index not initialized. Queries may fail.")
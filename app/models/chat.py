@@ -1,12 +1,21 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional
 
+from app.core.config import settings
+
 class Message(BaseModel):
     """Chat message model."""
     role: str = Field(..., description="Role of the message sender (user or assistant)")
     content: str = Field(..., description="Content of the message")
 
-class ChatRequest(BaseModel):
+class RetrievalOptions(BaseModel):
+    """Per-request retrieval overrides shared by the chat endpoints."""
+    top_k: Optional[int] = Field(default=None, ge=1, le=settings.MAX_RETRIEVAL_TOP_K, description="Number of chunks to send to the LLM")
+    candidate_pool: Optional[int] = Field(default=None, ge=1, le=settings.MAX_RETRIEVAL_CANDIDATE_POOL, description="Number of candidates retrieved before diversification")
+    token_budget: Optional[int] = Field(default=None, ge=1, le=settings.MAX_CONTEXT_TOKEN_BUDGET, description="Maximum number of context tokens sent to the LLM")
+    sources: Optional[List[str]] = Field(default=None, description="Restrict retrieval to these PDF filenames")
+
+class ChatRequest(RetrievalOptions):
     """Chat request model."""
     query: str = Field(..., description="User query/question")
     chat_history: Optional[List[Message]] = Field(default=[], description="Chat history for context")
@@ -21,3 +30,5 @@ class IndexResponse(BaseModel):
     status: str = Field(..., description="Status of the indexing operation")
     message: str = Field(..., description="Detailed message about the indexing operation")
     document_count: int = Field(..., description="Number of documents indexed")
+    retried_nodes: int = Field(default=0, description="Nodes whose embedding had to be retried during the last build")
+    failed_nodes: int = Field(default=0, description="Nodes in the dead-letter list after exhausting their retries")
@@ -0,0 +1,177 @@
+"""
+Replay a captured query log against the service and report latency distributions.
+
+Queries are re-sent at their recorded pace, sped up by --speed (0 sends them as fast
+as --concurrency allows). Entries logged in "hash" mode carry no text and are skipped;
+chat history is never logged, so follow-up questions are replayed without it.
+
+In-process replays bypass the embedding and answer caches unless --use-caches is given,
+so repeated queries measure the full pipeline. Replays over HTTP hit the server's caches
+as it is configured.
+
+Usage:
+    python -m app.replay [--log query_log.jsonl] [--speed 10] [--concurrency 8] [--limit N] [--use-caches]
+    python -m app.replay --url http://localhost:8000    # replay over HTTP against a running server
+"""
+
+import json
+import time
+import argparse
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import requests
+
+from app.core.config import settings
+from app.services.query_cache import LRUCache
+from app.services.query_log import load_query_log
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def http_runner(url: str, timeout: float) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    def run(entry: Dict[str, Any]) -> Dict[str, Any]:
+        response = requests.post(
+            f"{url.rstrip('/')}{entry.get('endpoint', '/chat/simple')}",
+            json={"query": entry["query"], **entry.get("options", {})},
+            timeout=timeout,
+        )
+        if response.status_code == 429:
+            return {"status": "rejected"}
+        return {"status": "ok" if response.ok else f"http_{response.status_code}"}
+    return run
+
+
+def in_process_runner(use_caches: bool = False) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    from app.services.vector_store import VectorStoreService
+
+    # Only loads the index, never builds one; queries made here are not written to the query log
+    service = VectorStoreService(serving=False)
+    if service.load_index(read_only=True) is None:
+        raise SystemExit("No index could be loaded; run `python -m app.ingest` first")
+    if not use_caches:
+        # Zero-sized caches miss every lookup and store nothing
+        service.embedding_cache = LRUCache(0)
+        service.answer_cache = LRUCache(0)
+
+    def run(entry: Dict[str, Any]) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {}
+        service.query(entry["query"], stats=stats, **entry.get("options", {}))
+        return stats
+    return run
+
+
+def replay(entries: List[Dict[str, Any]], run: Callable, speed: float, concurrency: int) -> List[Dict[str, Any]]:
+    """
+    Send the entries at their recorded offsets divided by speed. Returns one result per entry.
+
+    Latency is measured from when each entry was due, not from when a worker picked it up,
+    so time spent waiting for one of the concurrency workers counts as it would for a client.
+    """
+    results: List[Dict[str, Any]] = [None] * len(entries)
+    lock = threading.Lock()
+
+    def send(i: int, entry: Dict[str, Any], due: float):
+        try:
+            result = run(entry)
+        except Exception as e:
+            result = {"status": "error", "error": str(e)}
+        result["latency_seconds"] = time.perf_counter() - due
+        with lock:
+            results[i] = result
+
+    first_ts = entries[0].get("ts", 0)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i, entry in enumerate(entries):
+            if speed > 0:
+                due = started + (entry.get("ts", first_ts) - first_ts) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                due = time.perf_counter()
+            executor.submit(send, i, entry, due)
+    return results
+
+
+def distribution(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    data = np.asarray(values)
+    summary = {f"p{p}": float(np.percentile(data, p)) for p in PERCENTILES}
+    summary["mean"] = float(data.mean())
+    summary["max"] = float(data.max())
+    return summary
+
+
+def report(entries: List[Dict[str, Any]], results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    statuses: Dict[str, int] = {}
+    for result in results:
+        statuses[result.get("status", "ok")] = statuses.get(result.get("status", "ok"), 0) + 1
+
+    stages = {}
+    for stage in ("queue_seconds", "embedding_seconds", "retrieval_seconds", "synthesis_seconds"):
+        values = [r[stage] for r in results if stage in r]
+        if values:
+            stages[stage] = distribution(values)
+
+    return {
+        "queries": len(results),
+        "elapsed_seconds": elapsed,
+        "throughput_qps": len(results) / elapsed if elapsed else 0.0,
+        "statuses": statuses,
+        "latency_seconds": distribution([r["latency_seconds"] for r in results]),
+        "recorded_latency_seconds": distribution([e["latency_seconds"] for e in entries if "latency_seconds" in e]),
+        "stages": stages,
+    }
+
+
+def print_report(summary: Dict[str, Any]):
+    print(f"Replayed {summary['queries']} queries in {summary['elapsed_seconds']:.1f}s ({summary['throughput_qps']:.2f} queries/s)")
+    print("Outcomes: " + ", ".join(f"{status}={count}" for status, count in sorted(summary["statuses"].items())))
+    rows = [("replayed", summary["latency_seconds"]), ("recorded", summary["recorded_latency_seconds"])]
+    rows += [(stage.replace("_seconds", ""), dist) for stage, dist in summary["stages"].items()]
+    print(f"{'latency (s)':<12}" + "".join(f"{name:>9}" for name in ("p50", "p90", "p95", "p99", "mean", "max")))
+    for name, dist in rows:
+        if dist:
+            print(f"{name:<12}" + "".join(f"{dist[key]:>9.3f}" for key in ("p50", "p90", "p95", "p99", "mean", "max")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a captured query log and report latency distributions.")
+    parser.add_argument("--log", default=settings.QUERY_LOG_PATH, help="Query log to replay")
+    parser.add_argument("--url", help="Base URL of a running server; replays in-process when omitted")
+    parser.add_argument("--speed", type=float, default=1.0, help="Pace multiplier over the recorded pace; 0 sends without pauses")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum queries in flight")
+    parser.add_argument("--limit", type=int, help="Replay only the first N queries")
+    parser.add_argument("--timeout", type=float, default=settings.LLM_DEADLINE_SECONDS + 30, help="HTTP timeout per query")
+    parser.add_argument("--use-caches", action="store_true", help="Let in-process replays use the embedding and answer caches")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    entries = [entry for entry in load_query_log(args.log) if "query" in entry]
+    entries.sort(key=lambda entry: entry.get("ts", 0))
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        raise SystemExit(f"No replayable queries in {args.log}")
+
+    run = http_runner(args.url, args.timeout) if args.url else in_process_runner(args.use_caches)
+    started = time.perf_counter()
+    results = replay(entries, run, args.speed, args.concurrency)
+    summary = report(entries, results, time.perf_counter() - started)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_report(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "manifest.json"
+ARTIFACT_FORMAT_VERSION = 1
+
+
+class ArtifactError(Exception):
+    """Raised when an index artifact is corrupt or incompatible with the running configuration."""
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def corpus_manifest(pdf_files: List[str]) -> List[Dict[str, Any]]:
+    """Describe the source PDFs by name, size and content hash."""
+    return [
+        {
+            "filename": os.path.basename(path),
+            "bytes": os.path.getsize(path),
+            "sha256": sha256_file(path),
+        }
+        for path in sorted(pdf_files)
+    ]
+
+
+def build_settings() -> Dict[str, Any]:
+    """Settings that determine what an index holds; an artifact built with different ones is stale."""
+    return {
+        "embedding_model": settings.EMBEDDING_MODEL,
+        "embedding_dimension": settings.EMBEDDING_DIMENSION,
+        "chunk_size": settings.CHUNK_SIZE,
+        "chunk_overlap": settings.CHUNK_OVERLAP,
+        "dedup": {
+            "enabled": settings.DEDUP_ENABLED,
+            "threshold": settings.DEDUP_THRESHOLD,
+            "num_perm": settings.DEDUP_NUM_PERM,
+            "shingle_size": settings.DEDUP_SHINGLE_SIZE,
+            "scope": "shard",
+        },
+        "docstore_backend": settings.DOCSTORE_BACKEND,
+        "vector_sharding": settings.VECTOR_SHARDING,
+        "vector_shard_count": settings.VECTOR_SHARD_COUNT,
+    }
+
+
+def write_manifest(path: str, corpus: List[Dict[str, Any]], node_count: int, extra: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Checksum every file in the artifact directory and write the manifest next to them."""
+    artifacts = {
+        name: sha256_file(os.path.join(path, name))
+        for name in sorted(os.listdir(path))
+        if name != MANIFEST_FILENAME and os.path.isfile(os.path.join(path, name))
+    }
+    corpus_digest = hashlib.sha256(json.dumps(corpus, sort_keys=True).encode("utf-8")).hexdigest()
+    created_at = datetime.now(timezone.utc)
+
+    manifest = {
+        "format_version": ARTIFACT_FORMAT_VERSION,
+        "version": f"{created_at.strftime('%Y%m%dT%H%M%SZ')}-{corpus_digest[:8]}",
+        "created_at": created_at.isoformat(),
+        "app_version": settings.APP_VERSION,
+        **build_settings(),
+        "node_count": node_count,
+        "corpus_sha256": corpus_digest,
+        "corpus": corpus,
+        "artifacts": artifacts,
+    }
+    if extra:
+        manifest.update(extra)
+
+    with open(os.path.join(path, MANIFEST_FILENAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_manifest(path: str) -> Optional[Dict[str, Any]]:
+    manifest_path = os.path.join(path, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def remove_manifest(path: str):
+    """Drop the manifest once the directory no longer holds the artifact it describes."""
+    manifest_path = os.path.join(path, MANIFEST_FILENAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+
+def verify_artifact(path: str) -> Optional[Dict[str, Any]]:
+    """
+    Check an artifact against its manifest and the running configuration.
+
+    Returns the manifest, or None for directories without one (indexes built in-process).
+    Raises ArtifactError on checksum or embedding configuration mismatches.
+    """
+    manifest = read_manifest(path)
+    if manifest is None:
+        return None
+
+    if manifest.get("format_version") != ARTIFACT_FORMAT_VERSION:
+        raise ArtifactError(f"Unsupported artifact format version {manifest.get('format_version')}")
+    if manifest.get("embedding_model") != settings.EMBEDDING_MODEL:
+        raise ArtifactError(
+            f"Artifact was embedded with {manifest.get('embedding_model')}, "
+            f"but the server is configured for {settings.EMBEDDING_MODEL}"
+        )
+    if manifest.get("embedding_dimension") != settings.EMBEDDING_DIMENSION:
+        raise ArtifactError(
+            f"Artifact dimension {manifest.get('embedding_dimension')} does not match {settings.EMBEDDING_DIMENSION}"
+        )
+
+    for name, expected in manifest.get("artifacts", {}).items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path):
+            raise ArtifactError(f"Artifact file {name} is missing")
+        if sha256_file(file_path) != expected:
+            raise ArtifactError(f"Checksum mismatch for artifact file {name}")
+
+    return manifest
@@ -0,0 +1,152 @@
+import math
+import time
+import asyncio
+import hashlib
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; retry_after is a hint in seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def query_key(*parts: Any) -> str:
+    """Build a stable key for a query from its JSON-serializable parts."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Coalesce identical in-flight computations so concurrent callers share one result."""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+        # Shield so one caller disconnecting does not cancel the work other callers wait on
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved in case every waiter went away
+            task.exception()
+
+
+class RateLimiter:
+    """Per-client token bucket."""
+
+    def __init__(self, rate_per_minute: float = None, burst: int = None):
+        self.rate = (settings.RATE_LIMIT_PER_MINUTE if rate_per_minute is None else rate_per_minute) / 60.0
+        self.burst = settings.RATE_LIMIT_BURST if burst is None else burst
+        self._buckets: Dict[str, tuple] = {}
+
+    def check(self, client: str) -> float:
+        """Take a token for the client. Returns 0 when allowed, otherwise seconds until a token is available."""
+        if self.rate <= 0:
+            return 0.0
+
+        now = time.monotonic()
+        tokens, last = self._buckets.get(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+
+        if tokens >= 1:
+            self._buckets[client] = (tokens - 1, now)
+            self._prune(now)
+            return 0.0
+
+        self._buckets[client] = (tokens, now)
+        return (1 - tokens) / self.rate
+
+    def _prune(self, now: float):
+        """Drop buckets that have refilled completely to keep memory bounded."""
+        if len(self._buckets) < 10000:
+            return
+        full_after = self.burst / self.rate
+        for client in [c for c, (_, last) in self._buckets.items() if now - last > full_after]:
+            del self._buckets[client]
+
+
+class AdmissionController:
+    """Bound concurrent queries and the queue in front of them, rejecting fast once the queue is full."""
+
+    def __init__(self, max_concurrent: int = None, max_queue: int = None, queue_timeout: float = None):
+        self.max_concurrent = max_concurrent or settings.MAX_CONCURRENT_QUERIES
+        self.max_queue = settings.MAX_QUEUED_QUERIES if max_queue is None else max_queue
+        self.queue_timeout = queue_timeout or settings.QUEUE_TIMEOUT_SECONDS
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+        # Exponentially weighted average service time, used for Retry-After hints
+        self._avg_seconds = 1.0
+
+    def retry_after(self) -> float:
+        """Estimate how long until the current queue drains."""
+        return self._avg_seconds * (self.waiting + 1) / self.max_concurrent
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        if not self._semaphore.locked():
+            # A free slot is taken without suspending, so the next caller sees the updated count
+            await self._semaphore.acquire()
+        else:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionRejected("Server is busy, query queue is full.", self.retry_after())
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise AdmissionRejected("Server is busy, timed out waiting in the query queue.", self.retry_after())
+            finally:
+                self.waiting -= 1
+
+        self.running += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.monotonic() - start)
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "avg_seconds": round(self._avg_seconds, 3),
+        }
+
+
+# Singleton instances
+query_coalescer = SingleFlight()
+rate_limiter = RateLimiter()
+admission_controller = AdmissionController()
@@ -0,0 +1,186 @@
+import re
+import hashlib
+import logging
+from typing import List, Dict, Any, Tuple
+
+import numpy as np
+from llama_index.core.schema import BaseNode
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Large Mersenne prime used for the universal hash family (a * x + b) mod p
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_LOW_29 = np.uint64((1 << 29) - 1)
+_TOKEN_RE = re.compile(r"\w+")
+
+SOURCES_METADATA_KEY = "source_filenames"
+
+
+def _mod_mersenne(v: np.ndarray) -> np.ndarray:
+    """Reduce values below 2^64 modulo 2^61 - 1 without overflowing uint64."""
+    v = (v & _MERSENNE_PRIME) + (v >> np.uint64(61))
+    return np.where(v >= _MERSENNE_PRIME, v - _MERSENNE_PRIME, v)
+
+
+def _mulmod(a: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """
+    (a * x) mod (2^61 - 1) for a < 2^61 and x < 2^32, exactly.
+
+    The product needs up to 93 bits, so a is split into 32-bit halves. Since 2^61 = 1 mod p,
+    a high part shifted by 32 bits reduces to a shift and an add.
+    """
+    low = _mod_mersenne((a & _MAX_HASH) * x)
+    high = (a >> np.uint64(32)) * x
+    high = _mod_mersenne(((high & _LOW_29) << np.uint64(32)) + (high >> np.uint64(29)))
+    return _mod_mersenne(low + high)
+
+
+class MinHashDeduplicator:
+    """Detect near-duplicate chunks with MinHash signatures and LSH banding."""
+
+    def __init__(
+        self,
+        threshold: float = None,
+        num_perm: int = None,
+        shingle_size: int = None,
+        seed: int = 1,
+    ):
+        self.threshold = settings.DEDUP_THRESHOLD if threshold is None else threshold
+        self.num_perm = settings.DEDUP_NUM_PERM if num_perm is None else num_perm
+        self.shingle_size = settings.DEDUP_SHINGLE_SIZE if shingle_size is None else shingle_size
+        self.bands, self.rows = self._choose_bands(self.num_perm, self.threshold)
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, np.iinfo(np.int64).max, size=self.num_perm, dtype=np.int64).astype(np.uint64) % _MERSENNE_PRIME
+        self._b = rng.randint(0, np.iinfo(np.int64).max, size=self.num_perm, dtype=np.int64).astype(np.uint64) % _MERSENNE_PRIME
+
+    @staticmethod
+    def _choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+        """Pick the (bands, rows) split whose LSH threshold (1/b)^(1/r) is closest to the target."""
+        best = (num_perm, 1)
+        best_err = float("inf")
+        for rows in range(1, num_perm + 1):
+            if num_perm % rows:
+                continue
+            bands = num_perm // rows
+            err = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+            if err < best_err:
+                best, best_err = (bands, rows), err
+        return best
+
+    def _shingles(self, text: str) -> np.ndarray:
+        """Hash word n-gram shingles of normalized text to 32-bit integers."""
+        tokens = _TOKEN_RE.findall(text.lower())
+        if not tokens:
+            return np.zeros(0, dtype=np.uint64)
+        k = min(self.shingle_size, len(tokens))
+        grams = {" ".join(tokens[i:i + k]) for i in range(len(tokens) - k + 1)}
+        return np.fromiter(
+            (int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=4).digest(), "little") for g in grams),
+            dtype=np.uint64,
+            count=len(grams),
+        )
+
+    def signature(self, text: str) -> np.ndarray:
+        """Compute the MinHash signature of a text."""
+        shingles = self._shingles(text)
+        if shingles.size == 0:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        # (num_perm, n_shingles) matrix of permuted hashes; column-wise min per permutation
+        products = _mulmod(self._a[:, None], shingles[None, :])
+        hashed = _mod_mersenne(products + self._b[:, None]) & _MAX_HASH
+        return hashed.min(axis=1)
+
+    def find_clusters(self, texts: List[str]) -> List[List[int]]:
+        """Group indices of near-duplicate texts. Each cluster is ordered, its first index is the keeper."""
+        n = len(texts)
+        if n == 0:
+            return []
+        signatures = np.vstack([self.signature(t) for t in texts])
+
+        parent = list(range(n))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        def union(i: int, j: int):
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                # Keep the earliest chunk as the root so document order is preserved
+                parent[max(ri, rj)] = min(ri, rj)
+
+        for band in range(self.bands):
+            start = band * self.rows
+            buckets: Dict[bytes, List[int]] = {}
+            band_bytes = signatures[:, start:start + self.rows]
+            for i in range(n):
+                buckets.setdefault(band_bytes[i].tobytes(), []).append(i)
+            for members in buckets.values():
+                if len(members) < 2:
+                    continue
+                # Compare each member with every earlier one, not only the first: bucket-mates
+                # may be near-duplicates of each other without being close to the first member
+                for pos in range(1, len(members)):
+                    other = members[pos]
+                    for head in members[:pos]:
+                        if find(head) == find(other):
+                            continue
+                        similarity = float(np.mean(signatures[head] == signatures[other]))
+                        if similarity >= self.threshold:
+                            union(head, other)
+
+        clusters: Dict[int, List[int]] = {}
+        for i in range(n):
+            clusters.setdefault(find(i), []).append(i)
+        return sorted(clusters.values(), key=lambda c: c[0])
+
+
+def deduplicate_nodes(
+    nodes: List[BaseNode],
+    deduplicator: MinHashDeduplicator = None,
+) -> Tuple[List[BaseNode], Dict[str, Any]]:
+    """
+    Drop near-duplicate nodes before embedding.
+
+    The first node of each duplicate cluster is kept and its metadata records every
+    source filename the chunk appeared in, so provenance survives the merge.
+    """
+    if deduplicator is None:
+        deduplicator = MinHashDeduplicator()
+
+    texts = [node.get_content() for node in nodes]
+    clusters = deduplicator.find_clusters(texts)
+
+    kept_nodes = []
+    for cluster in clusters:
+        keeper = nodes[cluster[0]]
+        sources = []
+        for i in cluster:
+            metadata = nodes[i].metadata or {}
+            for filename in metadata.get(SOURCES_METADATA_KEY) or [metadata.get("filename", "unknown")]:
+                if filename not in sources:
+                    sources.append(filename)
+        keeper.metadata[SOURCES_METADATA_KEY] = sources
+        # Provenance is for callers, not for the embedding or the synthesis prompt
+        for excluded in (keeper.excluded_embed_metadata_keys, keeper.excluded_llm_metadata_keys):
+            if SOURCES_METADATA_KEY not in excluded:
+                excluded.append(SOURCES_METADATA_KEY)
+        kept_nodes.append(keeper)
+
+    dropped = len(nodes) - len(kept_nodes)
+    stats = {
+        "input_nodes": len(nodes),
+        "kept_nodes": len(kept_nodes),
+        "duplicate_nodes": dropped,
+        "duplicate_clusters": sum(1 for c in clusters if len(c) > 1),
+        # Every node is embedded with its own call and stored as its own vector
+        "embedding_calls_saved": dropped,
+        "vectors_saved": dropped,
+    }
+    return kept_nodes, stats
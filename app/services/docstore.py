@@ -0,0 +1,196 @@
+import os
+import json
+import sqlite3
+import threading
+import urllib.request
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.kvstore.types import BaseKVStore, DEFAULT_BATCH_SIZE, DEFAULT_COLLECTION
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteKVStore(BaseKVStore):
+    """
+    Key-value store on a local SQLite file with a small LRU cache for hot entries.
+
+    Node text and metadata stay on disk; only the entries read recently are held in memory.
+    Pickling keeps just the file path, so a pickled index reopens the same file on load.
+    A read-only store opens the file as immutable, with no journal, pragmas or schema
+    changes, so a sealed artifact can be served from a read-only filesystem.
+    """
+
+    def __init__(self, path: str, cache_size: int = None, read_only: bool = False):
+        self.path = path
+        self.cache_size = settings.DOCSTORE_CACHE_SIZE if cache_size is None else cache_size
+        self.read_only = read_only
+        self._open()
+
+    def _open(self):
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, str], dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Connected on first use, so unpickling an index never touches a stale path
+        self._conn = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None and self.read_only:
+            uri = f"file:{urllib.request.pathname2url(os.path.abspath(self.path))}?immutable=1"
+            self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        elif self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                "collection TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "PRIMARY KEY (collection, key)) WITHOUT ROWID"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def relocate(self, path: str, read_only: bool = False):
+        """Point the store at another file, e.g. after the artifact directory was moved."""
+        self.close()
+        self.path = path
+        self.read_only = read_only
+        self._cache.clear()
+
+    def __getstate__(self):
+        return {"path": self.path, "cache_size": self.cache_size}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self.cache_size = state["cache_size"]
+        self.read_only = False
+        self._open()
+
+    def _remember(self, cache_key: Tuple[str, str], val: dict):
+        if self.cache_size <= 0:
+            return
+        self._cache[cache_key] = val
+        self._cache.move_to_end(cache_key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put_all([(key, val)], collection=collection)
+
+    async def aput(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put(key, val, collection=collection)
+
+    def put_all(
+        self,
+        kv_pairs: List[Tuple[str, dict]],
+        collection: str = DEFAULT_COLLECTION,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> None:
+        with self._lock:
+            self._db().executemany(
+                "INSERT OR REPLACE INTO kv (collection, key, value) VALUES (?, ?, ?)",
+                [(collection, key, json.dumps(val)) for key, val in kv_pairs],
+            )
+            self._db().commit()
+            for key, _ in kv_pairs:
+                self._cache.pop((collection, key), None)
+
+    async def aput_all(
+        self,
+        kv_pairs: List[Tuple[str, dict]],
+        collection: str = DEFAULT_COLLECTION,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> None:
+        self.put_all(kv_pairs, collection=collection, batch_size=batch_size)
+
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        cache_key = (collection, key)
+        with self._lock:
+            if cache_key in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(cache_key)
+                return self._cache[cache_key]
+
+            self.misses += 1
+            row = self._db().execute(
+                "SELECT value FROM kv WHERE collection = ? AND key = ?", (collection, key)
+            ).fetchone()
+            if row is None:
+                return None
+            val = json.loads(row[0])
+            self._remember(cache_key, val)
+            return val
+
+    async def aget(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        return self.get(key, collection=collection)
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        # Reads the whole collection; only used by maintenance paths, never per query
+        with self._lock:
+            rows = self._db().execute("SELECT key, value FROM kv WHERE collection = ?", (collection,)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        return self.get_all(collection=collection)
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        with self._lock:
+            cursor = self._db().execute("DELETE FROM kv WHERE collection = ? AND key = ?", (collection, key))
+            self._db().commit()
+            self._cache.pop((collection, key), None)
+            return cursor.rowcount > 0
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.delete(key, collection=collection)
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._db().execute("DELETE FROM kv")
+            self._db().commit()
+            self._cache.clear()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def seal(self):
+        """
+        Checkpoint the write-ahead log into the file, switch to a rollback journal and close.
+
+        A WAL-mode file needs its -shm file to be created even for reads, which fails on a
+        read-only filesystem; a sealed file is self-contained.
+        """
+        with self._lock:
+            if not self.read_only:
+                self._db().execute("PRAGMA journal_mode=DELETE")
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"cached": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+class SQLiteDocumentStore(KVDocumentStore):
+    """Document store whose nodes live in a SQLite file and are loaded only when retrieved."""
+
+    def __init__(self, path: str = None, cache_size: int = None, namespace: Optional[str] = None, read_only: bool = False):
+        if path is None:
+            path = os.path.join(settings.VECTOR_DB_PATH, "docstore.sqlite")
+        self._sqlite_kvstore = SQLiteKVStore(path, cache_size=cache_size, read_only=read_only)
+        super().__init__(self._sqlite_kvstore, namespace=namespace)
+
+    @property
+    def kvstore(self) -> SQLiteKVStore:
+        return self._sqlite_kvstore
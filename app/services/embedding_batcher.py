@@ -0,0 +1,236 @@
+"""
+Micro-batching of concurrent query embeddings.
+
+Run `python -m app.services.embedding_batcher` to benchmark batched against direct
+embedding calls on a fake backend with a fixed per-call overhead.
+"""
+
+import time
+import queue
+import argparse
+import threading
+import logging
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """
+    Collect query texts from concurrent callers and embed them in one batch call.
+
+    The first text of a batch waits at most max_wait_ms for others to join, or until
+    max_batch_size texts are pending. Batches are sent on a small pool so collecting the
+    next batch does not wait for the previous call to return. Identical texts in a batch
+    are embedded once. Every submitted future is resolved: with its vector, or with the
+    error that stopped its batch.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        max_wait_ms: float = None,
+        max_batch_size: int = None,
+        max_concurrent_batches: int = None,
+    ):
+        self.embed_batch = embed_batch
+        self.max_wait = (settings.EMBED_BATCH_WINDOW_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+        self.max_batch_size = max_batch_size or settings.EMBED_MAX_BATCH_SIZE
+        self.max_concurrent_batches = max_concurrent_batches or settings.EMBED_MAX_CONCURRENT_BATCHES
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._collector = None
+        self._executor = None
+        self.batches = 0
+        self.texts = 0
+
+    def _start(self):
+        # Started on first use so forked worker processes never inherit a dead thread
+        with self._lock:
+            if self._collector is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent_batches, thread_name_prefix="embed-batch")
+                self._collector = threading.Thread(target=self._collect, name="embed-collector", daemon=True)
+                self._collector.start()
+
+    def submit(self, text: str) -> Future:
+        if self._collector is None:
+            self._start()
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str, timeout: float = None) -> List[float]:
+        return self.submit(text).result(timeout)
+
+    def embed_many(self, texts: List[str], timeout: float = None) -> List[List[float]]:
+        """Embed texts, raising concurrent.futures.TimeoutError if they are not all done within timeout seconds."""
+        futures = [self.submit(text) for text in texts]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            return [future.result(None if deadline is None else max(0.0, deadline - time.monotonic())) for future in futures]
+        except FuturesTimeoutError:
+            self._cancel(futures)
+            raise FuturesTimeoutError(f"Query embedding did not finish within {timeout:.1f}s") from None
+        except BaseException:
+            self._cancel(futures)
+            raise
+
+    @staticmethod
+    def _cancel(futures: List[Future]):
+        # Texts not yet sent are dropped from their batch
+        for future in futures:
+            future.cancel()
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                deadline = time.monotonic() + self.max_wait
+                while len(batch) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                self._executor.submit(self._send, batch)
+            except Exception as e:
+                # The collector must outlive any one batch, or every later caller would wait forever
+                logger.exception("Could not dispatch an embedding batch")
+                _fail(batch, e)
+
+    def _send(self, batch: List[Tuple[str, Future]]):
+        # Futures cancelled by callers that gave up are left out
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            unique = list(dict.fromkeys(text for text, _ in batch))
+            embeddings = self.embed_batch(unique)
+            if len(embeddings) != len(unique):
+                raise ValueError(f"Embedding backend returned {len(embeddings)} vectors for {len(unique)} texts")
+            vectors = dict(zip(unique, embeddings))
+            with self._lock:
+                self.batches += 1
+                self.texts += len(batch)
+            for text, future in batch:
+                future.set_result(vectors[text])
+        except Exception as e:
+            _fail(batch, e)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "texts": self.texts,
+                "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+            }
+
+
+def _fail(batch: List[Tuple[str, Future]], error: Exception):
+    """Resolve the futures of a batch that are still unresolved with error."""
+    for _, future in batch:
+        try:
+            future.set_exception(error)
+        except InvalidStateError:
+            # Already resolved or cancelled by its caller
+            pass
+
+
+def batch_query_embedder(get_embed_model: Callable[[], object]) -> Callable[[List[str]], List[List[float]]]:
+    """
+    Batch function for the configured embedding model.
+
+    GeminiEmbedding's synchronous batch method still makes one request per text, so for
+    Gemini the texts are sent in a single embed_content request, as its async path does.
+    Other models embed each text as a query.
+    """
+    def embed_batch(texts: List[str]) -> List[List[float]]:
+        embed_model = get_embed_model()
+        client = getattr(embed_model, "_model", None)
+        if type(embed_model).__name__ == "GeminiEmbedding" and client is not None:
+            return client.embed_content(
+                model=embed_model.model_name,
+                content=texts,
+                title=embed_model.title,
+                task_type=embed_model.task_type,
+                request_options=embed_model._request_options,
+            )["embedding"]
+        return [embed_model.get_query_embedding(text) for text in texts]
+    return embed_batch
+
+
+def benchmark(
+    concurrency: int,
+    queries_per_client: int,
+    call_overhead_ms: float,
+    per_text_ms: float,
+    connections: int,
+    window_ms: float,
+    max_batch_size: int,
+) -> Dict[str, Dict[str, float]]:
+    """Compare direct and batched embedding under concurrent callers on a fake backend."""
+    backend_lock = threading.Semaphore(connections)
+
+    def fake_backend(texts: List[str]) -> List[List[float]]:
+        # Fixed round-trip cost plus a small cost per text, with a cap on concurrent connections
+        with backend_lock:
+            time.sleep((call_overhead_ms + per_text_ms * len(texts)) / 1000.0)
+        return [[float(len(text))] for text in texts]
+
+    def run(embed_one: Callable[[str], List[float]]) -> Dict[str, float]:
+        latencies: List[float] = []
+        lock = threading.Lock()
+
+        def client(client_id: int):
+            for i in range(queries_per_client):
+                start = time.perf_counter()
+                embed_one(f"client {client_id} question {i}")
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(c,)) for c in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        data = np.asarray(latencies) * 1000.0
+        return {
+            "throughput_qps": len(latencies) / elapsed,
+            "p50_ms": float(np.percentile(data, 50)),
+            "p95_ms": float(np.percentile(data, 95)),
+        }
+
+    batcher = EmbeddingBatcher(fake_backend, max_wait_ms=window_ms, max_batch_size=max_batch_size)
+    results = {
+        "direct": run(lambda text: fake_backend([text])[0]),
+        "batched": run(batcher.embed),
+    }
+    results["batched"]["mean_batch_size"] = batcher.stats()["mean_batch_size"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark query-embedding micro-batching against a fake backend.")
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrent callers")
+    parser.add_argument("--queries", type=int, default=10, help="Queries per caller")
+    parser.add_argument("--call-overhead-ms", type=float, default=80.0, help="Fixed cost of one backend call")
+    parser.add_argument("--per-text-ms", type=float, default=1.0, help="Additional backend cost per text")
+    parser.add_argument("--connections", type=int, default=10, help="Concurrent backend calls allowed, like an HTTP connection pool")
+    parser.add_argument("--window-ms", type=float, default=settings.EMBED_BATCH_WINDOW_MS, help="Batch wait window")
+    parser.add_argument("--max-batch-size", type=int, default=settings.EMBED_MAX_BATCH_SIZE, help="Maximum texts per batch")
+    args = parser.parse_args()
+
+    results = benchmark(args.concurrency, args.queries, args.call_overhead_ms, args.per_text_ms, args.connections, args.window_ms, args.max_batch_size)
+    for name, result in results.items():
+        print(f"{name:<8} " + "  ".join(f"{key}={value:.1f}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+Persistent cache of PDF-to-markdown extraction.
+
+Files are keyed by content hash and pages by a hash of their content stream and the
+resources it draws (fonts, images, form XObjects) plus the document's heading map,
+all together with the extractor version. An unchanged file is served without opening
+it; in a changed file only the changed pages are re-extracted, unless the change moves
+heading levels on the others. Chunking happens after extraction, so changing chunk
+settings reuses the cache entirely.
+
+Usage:
+    python -m app.services.extraction_cache stats
+    python -m app.services.extraction_cache prune [--older-than-days N]
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+import logging
+from typing import Any, Dict, List, Optional
+
+import pymupdf
+import pymupdf4llm
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Bump when the way pages are extracted or joined changes
+EXTRACTION_FORMAT_VERSION = 3
+EXTRACTOR_VERSION = f"pymupdf4llm-{pymupdf4llm.__version__}/v{EXTRACTION_FORMAT_VERSION}"
+
+
+def file_hash(file_path: str) -> str:
+    """SHA-256 of the file contents."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+_REFERENCE_RE = re.compile(rb"(\d+) 0 R")
+
+
+def _page_tree_xrefs(doc) -> set:
+    """Xrefs of page and page-tree objects, which resource walks must not follow."""
+    xrefs = set()
+    for xref in range(1, doc.xref_length()):
+        kind, value = doc.xref_get_key(xref, "Type")
+        if kind == "name" and value in ("/Page", "/Pages"):
+            xrefs.add(xref)
+    return xrefs
+
+
+def heading_map(file_path: str) -> Optional[Any]:
+    """
+    The document-wide heading map pymupdf4llm assigns heading levels from, or None.
+
+    The classic converter ranks font sizes counted over all pages, whatever pages are
+    converted. The layout engine (pymupdf-layout) ranks the headings of the converted
+    pages instead and exposes no map; it only exports IdentifyHeaders when inactive.
+    """
+    identify = getattr(pymupdf4llm, "IdentifyHeaders", None)
+    return identify(file_path) if identify is not None else None
+
+
+def _heading_digest(headers) -> str:
+    return hashlib.sha256(repr((headers.body_limit, sorted(headers.header_id.items()))).encode("utf-8")).hexdigest()
+
+
+def _page_digest(doc, page, stop: set, stream_digests: Dict[int, bytes], context: str = "") -> str:
+    """
+    Hash a page together with everything it draws from.
+
+    The content stream alone is not enough: two pages whose streams both read "/Fm0 Do"
+    render different form XObjects, images or fonts. The page object and every object it
+    references (except the page tree) are hashed, with references renumbered in visiting
+    order so identical pages in different files still share a key.
+    """
+    digest = hashlib.sha256()
+    digest.update(context.encode("utf-8"))
+    digest.update(repr((tuple(page.rect), page.rotation)).encode("utf-8"))
+    order: Dict[int, int] = {page.xref: 0}
+    pending = [page.xref]
+
+    while pending:
+        xref = pending.pop(0)
+        if xref == page.xref:
+            keys = [k for k in doc.xref_get_keys(xref) if k not in ("Parent", "Contents")]
+            source = "".join(f"/{k} {doc.xref_get_key(xref, k)[1]}" for k in keys).encode("utf-8")
+            digest.update(page.read_contents())
+        else:
+            source = doc.xref_object(xref, compressed=True).encode("utf-8")
+
+        def renumber(match):
+            target = int(match.group(1))
+            if target in stop and target != page.xref:
+                return b"page"
+            if target not in order:
+                order[target] = len(order)
+                pending.append(target)
+            return b"@%d" % order[target]
+
+        digest.update(_REFERENCE_RE.sub(renumber, source))
+        if xref != page.xref and doc.xref_is_stream(xref):
+            if xref not in stream_digests:
+                stream_digests[xref] = hashlib.sha256(doc.xref_stream_raw(xref) or b"").digest()
+            digest.update(stream_digests[xref])
+    return digest.hexdigest()
+
+
+def page_hashes(file_path: str, context: str = "") -> List[str]:
+    """
+    Hash each page with its content stream, geometry and the resources it uses.
+
+    context is mixed into every key for what else the page's markdown depends on.
+    """
+    with pymupdf.open(file_path) as doc:
+        stop = _page_tree_xrefs(doc)
+        # Fonts and images are usually shared by many pages; hash each stream once per file
+        stream_digests: Dict[int, bytes] = {}
+        return [_page_digest(doc, page, stop, stream_digests, context) for page in doc]
+
+
+class ExtractionCache:
+    """SQLite-backed cache of per-page markdown."""
+
+    def __init__(self, path: str = None):
+        if path is None:
+            path = os.path.join(settings.EXTRACTION_CACHE_DIR, "extraction.sqlite")
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.file_hits = 0
+        self.page_hits = 0
+        self.page_misses = 0
+        self._lock = threading.Lock()
+        # Several ingestion worker processes may write at once
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "file_hash TEXT NOT NULL, extractor TEXT NOT NULL, page_hashes TEXT NOT NULL, "
+            "source TEXT, last_used REAL NOT NULL, PRIMARY KEY (file_hash, extractor))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "page_hash TEXT NOT NULL, extractor TEXT NOT NULL, markdown TEXT NOT NULL, "
+            "last_used REAL NOT NULL, PRIMARY KEY (page_hash, extractor))"
+        )
+        self._conn.commit()
+
+    def _cached_pages(self, hashes: List[str]) -> Dict[str, str]:
+        found = {}
+        for i in range(0, len(hashes), 500):
+            batch = hashes[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT page_hash, markdown FROM pages WHERE extractor = ? AND page_hash IN ({placeholders})",
+                [EXTRACTOR_VERSION] + batch,
+            ).fetchall()
+            found.update(rows)
+        return found
+
+    def extract(self, file_path: str) -> str:
+        """Return the markdown of a PDF, extracting only pages that are not cached yet."""
+        key = file_hash(file_path)
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT page_hashes FROM files WHERE file_hash = ? AND extractor = ?", (key, EXTRACTOR_VERSION)
+            ).fetchone()
+            hashes = json.loads(row[0]) if row else None
+            cached = self._cached_pages(hashes) if hashes else {}
+
+        if hashes and len(cached) == len(set(hashes)):
+            self.file_hits += 1
+            self.page_hits += len(hashes)
+        else:
+            # A page's heading levels depend on the rest of the document, so pages are keyed
+            # by its heading map too. The layout engine has none to key by; its pages are
+            # keyed by the file and only reused while the file is unchanged.
+            headers = heading_map(file_path)
+            hashes = page_hashes(file_path, _heading_digest(headers) if headers is not None else key)
+            with self._lock:
+                cached = self._cached_pages(hashes)
+            missing = [i for i, h in enumerate(hashes) if h not in cached]
+            self.page_hits += len(hashes) - len(missing)
+            self.page_misses += len(missing)
+
+            if missing:
+                # Converting with the map the keys were computed from, so it isn't scanned twice
+                pages = pymupdf4llm.to_markdown(
+                    file_path,
+                    page_chunks=True,
+                    pages=None if len(missing) == len(hashes) else missing,
+                    hdr_info=headers,
+                )
+                for i, page in zip(missing, pages):
+                    cached[hashes[i]] = page["text"]
+
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO pages (page_hash, extractor, markdown, last_used) VALUES (?, ?, ?, ?)",
+                    [(hashes[i], EXTRACTOR_VERSION, cached[hashes[i]], now) for i in missing],
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO files (file_hash, extractor, page_hashes, source, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (key, EXTRACTOR_VERSION, json.dumps(hashes), os.path.basename(file_path), now),
+                )
+                self._conn.commit()
+
+        with self._lock:
+            self._conn.execute(
+                "UPDATE files SET last_used = ? WHERE file_hash = ? AND extractor = ?", (now, key, EXTRACTOR_VERSION)
+            )
+            self._conn.executemany(
+                "UPDATE pages SET last_used = ? WHERE page_hash = ? AND extractor = ?",
+                [(now, h, EXTRACTOR_VERSION) for h in set(hashes)],
+            )
+            self._conn.commit()
+
+        # pymupdf4llm's single-string output is the concatenation of its page chunks
+        return "".join(cached[h] for h in hashes)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            files = self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            pages, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(markdown)), 0) FROM pages").fetchone()
+        return {
+            "extractor": EXTRACTOR_VERSION,
+            "files": files,
+            "pages": pages,
+            "markdown_bytes": size,
+            "file_hits": self.file_hits,
+            "page_hits": self.page_hits,
+            "page_misses": self.page_misses,
+        }
+
+    def prune(self, older_than_days: Optional[float] = None) -> Dict[str, int]:
+        """
+        Remove entries from other extractor versions, entries unused for older_than_days,
+        and pages no longer referenced by any cached file.
+        """
+        with self._lock:
+            removed_files = self._conn.execute("DELETE FROM files WHERE extractor != ?", (EXTRACTOR_VERSION,)).rowcount
+            removed_pages = self._conn.execute("DELETE FROM pages WHERE extractor != ?", (EXTRACTOR_VERSION,)).rowcount
+
+            if older_than_days is not None:
+                cutoff = time.time() - older_than_days * 86400
+                removed_files += self._conn.execute("DELETE FROM files WHERE last_used < ?", (cutoff,)).rowcount
+
+            referenced = set()
+            for (hashes,) in self._conn.execute("SELECT page_hashes FROM files"):
+                referenced.update(json.loads(hashes))
+            orphans = [(h,) for (h,) in self._conn.execute("SELECT page_hash FROM pages") if h not in referenced]
+            self._conn.executemany("DELETE FROM pages WHERE page_hash = ?", orphans)
+            removed_pages += len(orphans)
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+
+        return {"removed_files": removed_files, "removed_pages": removed_pages}
+
+
+_process_cache: Optional[ExtractionCache] = None
+
+
+def extract_markdown(file_path: str) -> str:
+    """Extract a PDF through a per-process cache. Safe to call from worker processes."""
+    global _process_cache
+    if not settings.EXTRACTION_CACHE_ENABLED:
+        return pymupdf4llm.to_markdown(file_path)
+    if _process_cache is None:
+        _process_cache = ExtractionCache()
+    return _process_cache.extract(file_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or prune the PDF extraction cache.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Show cache statistics")
+    prune_parser = subparsers.add_parser("prune", help="Remove stale cache entries")
+    prune_parser.add_argument("--older-than-days", type=float, default=None, help="Also remove files not used for this many days")
+    args = parser.parse_args()
+
+    cache = ExtractionCache()
+    if args.command == "prune":
+        print(json.dumps(cache.prune(args.older_than_days), indent=2))
+    print(json.dumps(cache.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
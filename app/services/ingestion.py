@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+from typing import Any, Callable, Dict, List, Tuple
+
+from llama_index.core.schema import BaseNode, MetadataMode, TextNode
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+STATE_FILENAME = "ingest_state.json"
+DEAD_LETTER_FILENAME = "dead_letter.jsonl"
+
+
+def stable_node_id(node: BaseNode) -> str:
+    """Derive a node ID from its source and position so a rerun recognizes work already done."""
+    key = "\0".join([
+        str(node.metadata.get("filename", "")),
+        str(node.start_char_idx),
+        node.get_content(),
+    ])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def retry_with_backoff(
+    func: Callable[[], Any],
+    attempts: int = None,
+    base_delay: float = None,
+    max_delay: float = None,
+    on_retry: Callable[[int, Exception], None] = None,
+) -> Any:
+    """Call func, retrying with exponential backoff and full jitter. Re-raises the last error."""
+    attempts = attempts or settings.INGEST_MAX_ATTEMPTS
+    base_delay = settings.INGEST_BACKOFF_BASE_SECONDS if base_delay is None else base_delay
+    max_delay = settings.INGEST_BACKOFF_MAX_SECONDS if max_delay is None else max_delay
+
+    for attempt in range(1, attempts + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            if on_retry:
+                on_retry(attempt, e)
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1))))
+
+
+class IngestionState:
+    """Progress and counters of an index build, persisted next to the index."""
+
+    def __init__(self, path: str):
+        self.path = os.path.join(path, STATE_FILENAME)
+        self.status = "new"
+        self.indexed_nodes = 0
+        self.retried_nodes = 0
+        self.failed_nodes = 0
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            self.status = data.get("status", self.status)
+            self.indexed_nodes = data.get("indexed_nodes", 0)
+            self.retried_nodes = data.get("retried_nodes", 0)
+            self.failed_nodes = data.get("failed_nodes", 0)
+
+    def reset(self):
+        self.status = "new"
+        self.indexed_nodes = 0
+        self.retried_nodes = 0
+        self.failed_nodes = 0
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "status": self.status,
+            "indexed_nodes": self.indexed_nodes,
+            "retried_nodes": self.retried_nodes,
+            "failed_nodes": self.failed_nodes,
+        }
+
+
+class DeadLetterQueue:
+    """Nodes that kept failing, persisted as JSON lines with the error so a later run can re-drive them."""
+
+    def __init__(self, path: str):
+        self.path = os.path.join(path, DEAD_LETTER_FILENAME)
+
+    def add(self, node: BaseNode, error: str, attempts: int):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        record = {
+            "node_id": node.node_id,
+            "filename": node.metadata.get("filename", "unknown"),
+            "error": error,
+            "attempts": attempts,
+            "failed_at": time.time(),
+            "node": node.to_dict(),
+        }
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def load(self) -> List[BaseNode]:
+        if not os.path.exists(self.path):
+            return []
+        nodes = {}
+        with open(self.path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    nodes[record["node_id"]] = TextNode.from_dict(record["node"])
+        return list(nodes.values())
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def remove(self, node_ids):
+        """Drop the given nodes, rewriting the list atomically with one record per remaining node."""
+        node_ids = set(node_ids)
+        if not node_ids or not os.path.exists(self.path):
+            return
+        records = {}
+        with open(self.path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if record["node_id"] not in node_ids:
+                        records[record["node_id"]] = record
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            for record in records.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def __len__(self) -> int:
+        return len(self.load())
+
+
+def embed_with_retry(nodes: List[BaseNode], embed_model) -> Tuple[List[BaseNode], List[Tuple[BaseNode, str]], int]:
+    """
+    Embed nodes, storing vectors on them.
+
+    The batch is tried once as a single call. If that fails, each node is embedded on its
+    own with retries, so one bad chunk neither sinks its neighbours nor makes them be
+    embedded again and again. Returns the embedded nodes, (node, error) pairs for nodes
+    that exhausted their retries, and how many nodes needed a retry.
+
+    Counters are returned rather than written to the ingestion state, so callers running
+    this on a thread pool update the state from one thread.
+    """
+    def text(node):
+        return node.get_content(metadata_mode=MetadataMode.EMBED)
+
+    try:
+        embeddings = embed_model.get_text_embedding_batch([text(node) for node in nodes])
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
+        return nodes, [], 0
+    except Exception as e:
+        logger.warning(f"Embedding batch of {len(nodes)} nodes failed ({str(e)}); embedding them individually")
+
+    embedded, failed, retried = [], [], 0
+    for node in nodes:
+        needed_retry = False
+
+        def note_retry(attempt: int, error: Exception):
+            nonlocal needed_retry
+            needed_retry = True
+
+        try:
+            node.embedding = retry_with_backoff(lambda: embed_model.get_text_embedding(text(node)), on_retry=note_retry)
+            embedded.append(node)
+        except Exception as e:
+            failed.append((node, str(e)))
+        retried += needed_retry
+    return embedded, failed, retried
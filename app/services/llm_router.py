@@ -0,0 +1,227 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when no provider answered before the request deadline."""
+
+
+class NoProviderAvailable(RuntimeError):
+    """Raised when every provider's circuit is open or every provider failed."""
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker driven by consecutive failures and the rolling error rate."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = None, error_rate_threshold: float = None, cooldown: float = None):
+        self.failure_threshold = failure_threshold or settings.BREAKER_FAILURE_THRESHOLD
+        self.error_rate_threshold = error_rate_threshold or settings.BREAKER_ERROR_RATE
+        self.cooldown = settings.BREAKER_COOLDOWN_SECONDS if cooldown is None else cooldown
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go through. In half-open state only one trial call is let through."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record(self, ok: bool, error_rate: float, samples: int):
+        with self._lock:
+            if ok:
+                self.consecutive_failures = 0
+                if self.state == self.HALF_OPEN:
+                    self.state = self.CLOSED
+                return
+
+            self.consecutive_failures += 1
+            tripped = (
+                self.state == self.HALF_OPEN
+                or self.consecutive_failures >= self.failure_threshold
+                or (samples >= self.failure_threshold and error_rate >= self.error_rate_threshold)
+            )
+            if tripped and self.state != self.OPEN:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class Provider:
+    """An LLM backend with rolling latency/error statistics and its own circuit breaker."""
+
+    def __init__(
+        self,
+        name: str,
+        build: Callable[[], Any],
+        with_timeout: Callable[[Any, float], Any],
+        window: int = None,
+        breaker: CircuitBreaker = None,
+    ):
+        # build creates the client once; with_timeout returns a view of it whose requests
+        # give up after the remaining deadline in seconds, without creating a new client
+        self.name = name
+        self.build = build
+        self.with_timeout = with_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._client = None
+        self._build_lock = threading.Lock()
+        self._samples = deque(maxlen=window or settings.PROVIDER_STATS_WINDOW)
+        self._lock = threading.Lock()
+
+    def client(self) -> Any:
+        """The provider's client, built on first use so an unused provider costs nothing at startup."""
+        with self._build_lock:
+            if self._client is None:
+                self._client = self.build()
+            return self._client
+
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self._samples.append((latency, ok))
+            samples = len(self._samples)
+            error_rate = self._error_rate()
+        self.breaker.record(ok, error_rate, samples)
+
+    def _error_rate(self) -> float:
+        if not self._samples:
+            return 0.0
+        return sum(1 for _, ok in self._samples if not ok) / len(self._samples)
+
+    def latency(self, quantile: float = 0.5) -> Optional[float]:
+        """Rolling latency quantile of successful calls, or None before the first success."""
+        with self._lock:
+            latencies = sorted(latency for latency, ok in self._samples if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(quantile * len(latencies)))]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = len(self._samples)
+            error_rate = self._error_rate()
+        return {
+            "state": self.breaker.state,
+            "samples": samples,
+            "error_rate": round(error_rate, 3),
+            "p50_seconds": self.latency(0.5),
+            "p95_seconds": self.latency(0.95),
+        }
+
+
+class LLMRouter:
+    """
+    Route LLM calls across providers.
+
+    Providers are tried fastest first by rolling median latency, skipping those whose
+    circuit is open. If the first provider hasn't answered within hedge_after seconds a
+    hedged request goes to the next one, and whichever succeeds first wins. The deadline
+    bounds the whole call and is set on each provider request.
+    """
+
+    def __init__(self, providers: List[Provider], hedge_after: float = None, max_workers: int = 8):
+        self.providers = providers
+        self.hedge_after = settings.HEDGE_AFTER_SECONDS if hedge_after is None else hedge_after
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-router")
+        self.hedged = 0
+
+    def _ranked(self) -> List[Provider]:
+        # Keep configuration order until latencies are known, then prefer the faster provider
+        def key(item):
+            position, provider = item
+            latency = provider.latency()
+            return (latency is None, latency or 0.0, position)
+        return [p for _, p in sorted(enumerate(self.providers), key=key)]
+
+    def _launch(self, provider: Provider, func: Callable[[Any], Any], deadline_at: float) -> Future:
+        def run():
+            start = time.monotonic()
+            try:
+                client = provider.client()
+                result = func(provider.with_timeout(client, max(0.1, deadline_at - time.monotonic())))
+            except Exception:
+                provider.record(time.monotonic() - start, ok=False)
+                raise
+            provider.record(time.monotonic() - start, ok=True)
+            return result
+
+        return self._executor.submit(run)
+
+    def call(self, func: Callable[[Any], Any], deadline: float = None) -> Any:
+        """Call func(llm) on the best available provider within the deadline (seconds)."""
+        deadline = deadline or settings.LLM_DEADLINE_SECONDS
+        deadline_at = time.monotonic() + deadline
+        candidates = iter(self._ranked())
+        in_flight: Dict[Future, Provider] = {}
+        last_error: Optional[Exception] = None
+
+        def launch_next() -> bool:
+            for provider in candidates:
+                if provider.breaker.allow():
+                    in_flight[self._launch(provider, func, deadline_at)] = provider
+                    return True
+                logger.info(f"Skipping provider {provider.name}: circuit {provider.breaker.state}")
+            return False
+
+        if not launch_next():
+            raise NoProviderAvailable("No LLM provider available: all circuits are open.")
+
+        hedge_at = time.monotonic() + self.hedge_after if self.hedge_after else None
+        while in_flight:
+            now = time.monotonic()
+            if now >= deadline_at:
+                break
+            wait_until = min(deadline_at, hedge_at) if hedge_at else deadline_at
+            done, _ = wait(list(in_flight), timeout=max(0.0, wait_until - now), return_when=FIRST_COMPLETED)
+
+            if not done:
+                if hedge_at and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    slow = ", ".join(p.name for p in in_flight.values())
+                    if launch_next():
+                        self.hedged += 1
+                        logger.info(f"Hedging: {slow} slower than {self.hedge_after}s")
+                continue
+
+            for future in done:
+                provider = in_flight.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    last_error = e
+                    logger.warning(f"Provider {provider.name} failed: {str(e)}")
+
+            # Everything in flight failed; fall through to the next provider without waiting
+            if not in_flight:
+                launch_next()
+
+        # Calls still running are left to finish in the background; their outcome still feeds the stats
+        if in_flight:
+            raise DeadlineExceeded(f"No LLM provider answered within {deadline}s.")
+        raise NoProviderAvailable(f"All LLM providers failed. Last error: {str(last_error)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedged_requests": self.hedged,
+            "providers": {p.name: p.stats() for p in self.providers},
+        }
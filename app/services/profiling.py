@@ -0,0 +1,285 @@
+import os
+import sys
+import time
+import functools
+import threading
+import tracemalloc
+import logging
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Leaf functions of threads that are parked, not working; left out of CPU profiles by default
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("base_events.py", "_run_once"),
+}
+
+# Packages whose modules own allocations; frames in other libraries (google, grpc, sqlite3, numpy...)
+# are skipped, since the same library serves several components
+_OWNER_PACKAGES = ("app", "llama_index")
+
+# Module paths, from the owning package on, that identify which VectorStoreService component
+# made an allocation. The innermost frame in an owning package that matches one decides.
+COMPONENTS = {
+    "faiss_index": ("llama_index/vector_stores/faiss/", "app/services/sharded_store.py"),
+    "docstore": ("llama_index/core/storage/docstore/", "llama_index/core/storage/kvstore/", "app/services/docstore.py"),
+    "llm_clients": ("llama_index/llms/", "llama_index/core/llms/", "app/services/llm_router.py"),
+    "embeddings": ("llama_index/embeddings/", "llama_index/core/base/embeddings/", "app/services/embedding_batcher.py"),
+    "index_struct": ("llama_index/core/data_structs/", "llama_index/core/indices/"),
+    "query_caches": ("app/services/query_cache.py", "app/services/extraction_cache.py"),
+}
+# Modules imported lazily after startup, e.g. tokenizers on first use
+_IMPORT_FRAME = "<frozen importlib._bootstrap"
+
+
+class ProfilerBusy(Exception):
+    """Raised when a CPU profile is requested while another one is running."""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_cpu(seconds: float, interval: float = 0.01, include_idle: bool = False) -> Dict[str, int]:
+    """
+    Sample the Python stacks of every thread for a number of seconds.
+
+    Returns collapsed stacks ("thread;outer;...;inner" -> samples), the input format of
+    flamegraph.pl and speedscope. Nothing is installed in the interpreter, so there is no
+    cost outside the sampling window.
+    """
+    own_id = threading.get_ident()
+    names = {}
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        names.update({t.ident: t.name for t in threading.enumerate()})
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+            if not include_idle and leaf in _IDLE_LEAVES:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, str(thread_id)))
+            stacks[";".join(reversed(labels))] += 1
+        time.sleep(interval)
+
+    return dict(stacks)
+
+
+def collapsed(stacks: Dict[str, int]) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+class CPUProfiler:
+    """Runs one sampling CPU profile at a time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float, interval: float = 0.01, include_idle: bool = False) -> str:
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A CPU profile is already running.")
+        try:
+            logger.info(f"Sampling CPU profile for {seconds}s")
+            return collapsed(sample_cpu(seconds, interval, include_idle))
+        finally:
+            self._lock.release()
+
+
+@functools.lru_cache(maxsize=4096)
+def _owner_path(filename: str) -> Optional[str]:
+    """Path of a source file from its owning package on ("app/services/..."), or None for other code."""
+    parts = filename.replace(os.sep, "/").split("/")
+    for i in range(len(parts) - 1, -1, -1):
+        if parts[i] in _OWNER_PACKAGES:
+            return "/".join(parts[i:])
+    return None
+
+
+@functools.lru_cache(maxsize=4096)
+def _frame_component(filename: str) -> Optional[str]:
+    if filename.startswith(_IMPORT_FRAME):
+        return "imports"
+    path = _owner_path(filename)
+    if path is None:
+        return None
+    for component, prefixes in COMPONENTS.items():
+        if path.startswith(prefixes):
+            return component
+    return None
+
+
+def _component_of(traceback: tracemalloc.Traceback) -> str:
+    # Tracebacks are stored most recent call first
+    for frame in traceback:
+        component = _frame_component(frame.filename)
+        if component is not None:
+            return component
+    return "other"
+
+
+def _by_component(stats: List[tracemalloc.Statistic]) -> Dict[str, Dict[str, int]]:
+    components: Dict[str, Dict[str, int]] = {}
+    for stat in stats:
+        entry = components.setdefault(_component_of(stat.traceback), {"bytes": 0, "blocks": 0})
+        entry["bytes"] += stat.size
+        entry["blocks"] += stat.count
+    return dict(sorted(components.items(), key=lambda item: -item[1]["bytes"]))
+
+
+def _by_component_diff(diffs: List[tracemalloc.StatisticDiff]) -> Dict[str, Dict[str, int]]:
+    components: Dict[str, Dict[str, int]] = {}
+    for diff in diffs:
+        entry = components.setdefault(_component_of(diff.traceback), {"bytes_diff": 0, "blocks_diff": 0})
+        entry["bytes_diff"] += diff.size_diff
+        entry["blocks_diff"] += diff.count_diff
+    return dict(sorted(components.items(), key=lambda item: -abs(item[1]["bytes_diff"])))
+
+
+def _location(traceback: tracemalloc.Traceback) -> str:
+    frame = traceback[0]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+def native_sizes(service) -> Dict[str, Any]:
+    """
+    Memory tracemalloc cannot see: FAISS vectors live in C++ and SQLite pages in its own cache.
+
+    Flat FAISS indexes hold ntotal * dimension float32 values, so that product is reported.
+    """
+    sizes: Dict[str, Any] = {}
+    vector_store = getattr(service, "vector_store", None)
+    client = getattr(vector_store, "client", None)
+    if isinstance(client, dict):
+        sizes["faiss_vectors"] = sum(index.ntotal for index in client.values())
+    elif client is not None:
+        sizes["faiss_vectors"] = client.ntotal
+    if "faiss_vectors" in sizes:
+        sizes["faiss_index_bytes"] = sizes["faiss_vectors"] * settings.EMBEDDING_DIMENSION * 4
+
+    index = getattr(service, "index", None)
+    if index is not None:
+        sizes["index_nodes"] = len(index.index_struct.nodes_dict)
+        kvstore = getattr(index.docstore, "kvstore", None)
+        if hasattr(kvstore, "path") and os.path.exists(kvstore.path):
+            sizes["docstore_file_bytes"] = os.path.getsize(kvstore.path)
+        if hasattr(kvstore, "stats"):
+            sizes["docstore_cache"] = kvstore.stats()
+
+    for name in ("embedding_cache", "answer_cache"):
+        cache = getattr(service, name, None)
+        if cache is not None:
+            sizes[name] = cache.stats()
+
+    try:
+        with open("/proc/self/statm") as f:
+            sizes["rss_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    return sizes
+
+
+class MemoryProfiler:
+    """
+    tracemalloc snapshots with diffs, attributed to the components of VectorStoreService.
+
+    Tracing starts with start() (at startup with PROFILING_TRACE_AT_STARTUP) or the first
+    snapshot and stops on stop(), so it costs nothing until used. Memory allocated before
+    tracing started is not attributed.
+    """
+
+    def __init__(self, max_snapshots: int = None, frames: int = None):
+        self.max_snapshots = max_snapshots or settings.PROFILING_MAX_SNAPSHOTS
+        self.frames = frames or settings.PROFILING_TRACEBACK_FRAMES
+        self._snapshots: Dict[int, tracemalloc.Snapshot] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def start(self) -> bool:
+        """Start tracing if it is not running. Returns whether it was started."""
+        if tracemalloc.is_tracing():
+            return False
+        tracemalloc.start(self.frames)
+        return True
+
+    def snapshot(self, service=None, top: int = 20) -> Dict[str, Any]:
+        with self._lock:
+            started = self.start()
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ])
+            snapshot_id = self._next_id
+            self._next_id += 1
+            self._snapshots[snapshot_id] = snapshot
+            while len(self._snapshots) > self.max_snapshots:
+                del self._snapshots[min(self._snapshots)]
+
+        stats = snapshot.statistics("traceback")
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "id": snapshot_id,
+            "tracing_started": started,
+            "traced_bytes": current,
+            "peak_traced_bytes": peak,
+            "components": _by_component(stats),
+            "native": native_sizes(service) if service is not None else {},
+            "top": [
+                {"location": _location(stat.traceback), "bytes": stat.size, "blocks": stat.count}
+                for stat in stats[:top]
+            ],
+        }
+
+    def diff(self, base: int, target: Optional[int] = None, top: int = 20) -> Dict[str, Any]:
+        with self._lock:
+            if target is None and self._snapshots:
+                target = max(self._snapshots)
+            if base not in self._snapshots or target not in self._snapshots:
+                raise KeyError(f"Unknown snapshot; available: {sorted(self._snapshots)}")
+            old, new = self._snapshots[base], self._snapshots[target]
+
+        diffs = new.compare_to(old, "traceback")
+        return {
+            "base": base,
+            "target": target,
+            "bytes_diff": sum(d.size_diff for d in diffs),
+            "components": _by_component_diff(diffs),
+            "top": [
+                {
+                    "location": _location(d.traceback),
+                    "bytes_diff": d.size_diff,
+                    "blocks_diff": d.count_diff,
+                    "bytes": d.size,
+                }
+                for d in diffs[:top]
+            ],
+        }
+
+    def snapshots(self) -> List[int]:
+        with self._lock:
+            return sorted(self._snapshots)
+
+    def stop(self):
+        with self._lock:
+            self._snapshots.clear()
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+
+# Singleton instances
+cpu_profiler = CPUProfiler()
+memory_profiler = MemoryProfiler()
@@ -0,0 +1,149 @@
+import os
+import re
+import json
+import time
+import queue
+import atexit
+import hashlib
+import logging
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Personal data that should never reach the log, masked in "redacted" mode
+_REDACTIONS = [
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<email>"),
+    (re.compile(r"https?://\S+"), "<url>"),
+    (re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}\b"), "<ip>"),
+    (re.compile(r"\+?\d[\d\s().-]{6,}\d"), "<number>"),
+]
+
+
+def redact(text: str) -> str:
+    for pattern, placeholder in _REDACTIONS:
+        text = pattern.sub(placeholder, text)
+    return text
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def query_hash(text: str) -> str:
+    return hashlib.sha256(normalize_query(text).encode("utf-8")).hexdigest()[:16]
+
+
+class QueryLog:
+    """
+    Append-only JSON lines log of chat queries with their per-stage timings.
+
+    Chat history is never written, only its length. Depending on the mode the query
+    text is stored redacted, verbatim, or not at all (hash only, which cannot be replayed).
+    Entries are written by a background thread, so recording never blocks on file I/O.
+    """
+
+    def __init__(self, path: str = None, mode: str = None, enabled: bool = None):
+        self.path = path or settings.QUERY_LOG_PATH
+        self.mode = mode or settings.QUERY_LOG_MODE
+        self.enabled = settings.QUERY_LOG_ENABLED if enabled is None else enabled
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._writer = None
+
+    def _start(self):
+        # Started on first use so forked worker processes never inherit a dead thread
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write, name="query-log-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+
+    def record(
+        self,
+        endpoint: str,
+        query_text: str,
+        chat_history: Optional[List[dict]],
+        options: Dict[str, Any],
+        status: str,
+        latency: float,
+        stages: Dict[str, Any] = None,
+        coalesced: bool = False,
+    ):
+        if not self.enabled:
+            return
+
+        entry = {
+            "ts": round(time.time(), 3),
+            "endpoint": endpoint,
+            "query_hash": query_hash(query_text),
+            "history_turns": len(chat_history or []) // 2,
+            "options": {k: v for k, v in options.items() if v is not None},
+            "status": status,
+            "coalesced": coalesced,
+            "latency_seconds": round(latency, 4),
+            "stages": {k: round(v, 4) for k, v in (stages or {}).items() if k.endswith("_seconds")},
+        }
+        if self.mode == "full":
+            entry["query"] = query_text
+        elif self.mode == "redacted":
+            entry["query"] = redact(query_text)
+
+        if self._writer is None:
+            self._start()
+        self._queue.put(json.dumps(entry))
+
+    def _write(self):
+        while True:
+            lines = [self._queue.get()]
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a") as f:
+                    f.write("".join(line + "\n" for line in lines))
+            except OSError as e:
+                # Capture must never fail a request
+                logger.warning(f"Could not write query log: {str(e)}")
+            finally:
+                for _ in lines:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Wait until every recorded entry has been written."""
+        self._queue.join()
+
+
+def load_query_log(path: str = None) -> Iterator[Dict[str, Any]]:
+    """Yield the entries of a query log, skipping lines that cannot be parsed."""
+    path = path or settings.QUERY_LOG_PATH
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def top_queries(path: str = None, limit: int = 20) -> List[Tuple[str, Dict[str, Any], int]]:
+    """The most frequent replayable queries as (query, options, count), most frequent first."""
+    counts: Counter = Counter()
+    examples: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    for entry in load_query_log(path):
+        if "query" not in entry or entry.get("history_turns") or entry.get("status") not in ("ok", "cached"):
+            continue
+        key = json.dumps([normalize_query(entry["query"]), entry.get("options", {})], sort_keys=True)
+        counts[key] += 1
+        examples.setdefault(key, (entry["query"], entry.get("options", {})))
+    return [(*examples[key], count) for key, count in counts.most_common(limit)]
+
+
+# Singleton instance
+query_log = QueryLog()
@@ -0,0 +1,174 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.constants import DEFAULT_SIMILARITY_TOP_K
+from llama_index.core.indices.vector_store.retrievers import VectorIndexRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.types import VectorStoreQueryResult
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def mmr_select(query_embedding: np.ndarray, candidate_embeddings: np.ndarray, top_k: int, mmr_lambda: float) -> List[int]:
+    """
+    Pick up to top_k candidate rows by maximal marginal relevance.
+
+    Relevance and redundancy are cosine similarities computed in one matrix product
+    each; the greedy loop only updates a running max per candidate.
+    """
+    n = candidate_embeddings.shape[0]
+    if n == 0 or top_k <= 0:
+        return []
+
+    def normalize(x: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(x, axis=-1, keepdims=True)
+        return x / np.where(norms == 0, 1.0, norms)
+
+    candidates = normalize(candidate_embeddings.astype(np.float32))
+    query = normalize(np.asarray(query_embedding, dtype=np.float32))
+    relevance = candidates @ query
+    pairwise = candidates @ candidates.T
+
+    selected = [int(np.argmax(relevance))]
+    max_redundancy = pairwise[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+
+    while len(selected) < min(top_k, n):
+        scores = mmr_lambda * relevance - (1.0 - mmr_lambda) * max_redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_redundancy, pairwise[best], out=max_redundancy)
+
+    return selected
+
+
+def count_tokens(node: NodeWithScore) -> int:
+    """Count the tokens a node contributes to the synthesis prompt."""
+    return len(Settings.tokenizer(node.node.get_content(metadata_mode=MetadataMode.LLM)))
+
+
+def pack_to_budget(nodes: List[NodeWithScore], token_budget: int) -> List[NodeWithScore]:
+    """Keep nodes in order while they fit the token budget. The first node is always kept."""
+    packed = []
+    used = 0
+    for node in nodes:
+        tokens = count_tokens(node)
+        if packed and used + tokens > token_budget:
+            continue
+        packed.append(node)
+        used += tokens
+    return packed
+
+
+class SynthesisLatencyModel:
+    """
+    Rolling least-squares fit of synthesis seconds against context tokens.
+
+    The slope estimates what each prompt token costs in LLM latency, so the tokens saved by
+    MMR and budgeting can be reported as seconds saved without a second, baseline LLM call.
+    """
+
+    def __init__(self, window: int = None, min_samples: int = 10):
+        self._samples = deque(maxlen=window or settings.SYNTHESIS_LATENCY_WINDOW)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def observe(self, tokens: int, seconds: float):
+        with self._lock:
+            self._samples.append((tokens, seconds))
+
+    def seconds_per_token(self) -> Optional[float]:
+        with self._lock:
+            samples = list(self._samples)
+        if len(samples) < self.min_samples:
+            return None
+        tokens, seconds = np.asarray(samples, dtype=np.float64).T
+        if np.ptp(tokens) == 0:
+            return None
+        slope = np.polyfit(tokens, seconds, 1)[0]
+        return max(float(slope), 0.0)
+
+
+class MMRRetriever(VectorIndexRetriever):
+    """Retriever that over-fetches candidates, diversifies them with MMR and packs them into a token budget."""
+
+    def __init__(
+        self,
+        index,
+        top_k: int = None,
+        candidate_pool: int = None,
+        token_budget: int = None,
+        mmr_lambda: float = None,
+        **kwargs: Any,
+    ):
+        self.top_k = top_k or settings.RETRIEVAL_TOP_K
+        self.candidate_pool = max(candidate_pool or settings.RETRIEVAL_CANDIDATE_POOL, self.top_k)
+        self.token_budget = token_budget or settings.CONTEXT_TOKEN_BUDGET
+        self.mmr_lambda = settings.MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+        self.last_stats: Dict[str, Any] = {}
+        super().__init__(index, similarity_top_k=self.candidate_pool, **kwargs)
+
+    def _candidate_embeddings(self, ids: List[str]) -> Optional[np.ndarray]:
+        """Read candidate vectors back from FAISS, or None when the store cannot reconstruct them."""
+        if hasattr(self._vector_store, "get_embeddings"):
+            return self._vector_store.get_embeddings(ids)
+        faiss_index = getattr(self._vector_store, "client", None)
+        if faiss_index is None or not hasattr(faiss_index, "reconstruct_batch"):
+            return None
+        try:
+            return faiss_index.reconstruct_batch(np.array([int(i) for i in ids], dtype=np.int64))
+        except Exception as e:
+            logger.warning(f"Could not reconstruct candidate embeddings: {str(e)}")
+            return None
+
+    def _scored_nodes(self, query_result: VectorStoreQueryResult) -> List[NodeWithScore]:
+        nodes_to_fetch = self._determine_nodes_to_fetch(query_result)
+        if nodes_to_fetch:
+            fetched_nodes = self._docstore.get_nodes(node_ids=nodes_to_fetch, raise_error=False)
+            query_result.nodes = self._insert_fetched_nodes_into_query_result(query_result, fetched_nodes)
+        return self._convert_nodes_to_scored_nodes(query_result)
+
+    def _get_nodes_with_embeddings(self, query_bundle_with_embeddings: QueryBundle) -> List[NodeWithScore]:
+        start = time.perf_counter()
+        query = self._build_vector_store_query(query_bundle_with_embeddings)
+        query_result = self._vector_store.query(query, **self._kwargs)
+        ids = list(query_result.ids or [])
+        similarities = list(query_result.similarities or [])
+
+        order = list(range(min(self.top_k, len(ids))))
+        if len(ids) > self.top_k:
+            embeddings = self._candidate_embeddings(ids)
+            if embeddings is not None:
+                order = mmr_select(np.asarray(query_bundle_with_embeddings.embedding), embeddings, self.top_k, self.mmr_lambda)
+
+        # Fetch what the previous engine sent (plain top-k at llama-index's default) so the saving can be reported
+        baseline = list(range(min(DEFAULT_SIMILARITY_TOP_K, len(ids))))
+        fetch = order + [i for i in baseline if i not in order]
+        scored = self._scored_nodes(VectorStoreQueryResult(
+            ids=[ids[i] for i in fetch],
+            similarities=[similarities[i] for i in fetch] if similarities else None,
+        ))
+        by_position = dict(zip(fetch, scored))
+
+        selected = pack_to_budget([by_position[i] for i in order], self.token_budget)
+        context_tokens = sum(count_tokens(n) for n in selected)
+        baseline_tokens = sum(count_tokens(by_position[i]) for i in baseline)
+        self.last_stats = {
+            "candidates": len(ids),
+            "selected": len(selected),
+            "context_tokens": context_tokens,
+            "baseline_tokens": baseline_tokens,
+            "prompt_tokens_saved": baseline_tokens - context_tokens,
+            "retrieval_seconds": time.perf_counter() - start,
+        }
+        return selected
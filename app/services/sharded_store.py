@@ -0,0 +1,210 @@
+import hashlib
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterOperator,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+from app.core.config import settings
+from app.services.dedup import SOURCES_METADATA_KEY
+
+logger = logging.getLogger(__name__)
+
+# FAISS releases the GIL while searching, so shards are searched on plain threads
+_search_pool: Optional[ThreadPoolExecutor] = None
+_search_pool_lock = threading.Lock()
+
+
+def _get_search_pool() -> ThreadPoolExecutor:
+    global _search_pool
+    with _search_pool_lock:
+        if _search_pool is None:
+            _search_pool = ThreadPoolExecutor(max_workers=settings.SHARD_SEARCH_THREADS, thread_name_prefix="faiss-shard")
+        return _search_pool
+
+
+def shard_key_for(filename: str, mode: str = None, shard_count: int = None) -> str:
+    """Shard of a source document: the document itself, or a stable hash bucket of its name."""
+    mode = mode or settings.VECTOR_SHARDING
+    shard_count = shard_count or settings.VECTOR_SHARD_COUNT
+    if mode == "document":
+        return filename
+    digest = hashlib.md5(filename.encode("utf-8")).digest()
+    return f"shard-{int.from_bytes(digest[:8], 'big') % shard_count:03d}"
+
+
+class ShardedFaissVectorStore(BasePydanticVectorStore):
+    """
+    FAISS vector store split into shards, one per source document or per hash bucket.
+
+    All chunks of a document land in the same shard, so a document or shard can be
+    rebuilt without touching the others. Queries search the selected shards in
+    parallel and merge their top-k by distance. A filename filter on the query routes
+    it to the shards holding those documents only; a chunk deduplicated across documents
+    lives in its keeper's shard but matches a filter on any of its source filenames.
+    Vector IDs are "<shard>:<id>".
+    """
+
+    stores_text: bool = False
+    mode: str = "fixed"
+    shard_count: int = 4
+    dimension: int = 768
+
+    _shards: Dict[str, Any] = PrivateAttr(default_factory=dict)
+    _next_id: Dict[str, int] = PrivateAttr(default_factory=dict)
+    # shard -> filename -> FAISS IDs, for every source filename of a chunk; used for routing and filtering
+    _files: Dict[str, Dict[str, List[int]]] = PrivateAttr(default_factory=dict)
+    # ref_doc_id -> (shard, filename) and the FAISS IDs of the document's own chunks, used for deletes
+    _ref_docs: Dict[str, Tuple[str, str]] = PrivateAttr(default_factory=dict)
+    _doc_vectors: Dict[str, List[int]] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, mode: str = None, shard_count: int = None, dimension: int = None):
+        super().__init__(
+            mode=mode or settings.VECTOR_SHARDING,
+            shard_count=shard_count or settings.VECTOR_SHARD_COUNT,
+            dimension=dimension or settings.EMBEDDING_DIMENSION,
+        )
+
+    @property
+    def client(self) -> Dict[str, Any]:
+        """Return the FAISS index of every shard."""
+        return self._shards
+
+    @property
+    def ntotal(self) -> int:
+        return sum(shard.ntotal for shard in self._shards.values())
+
+    def _shard(self, key: str):
+        if key not in self._shards:
+            # IDMap2 keeps IDs stable across removals and can reconstruct vectors for MMR
+            self._shards[key] = faiss.IndexIDMap2(faiss.IndexFlatL2(self.dimension))
+            self._next_id[key] = 0
+            self._files[key] = {}
+        return self._shards[key]
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        new_ids = []
+        for node in nodes:
+            filename = node.metadata.get("filename", "unknown")
+            key = shard_key_for(filename, self.mode, self.shard_count)
+            shard = self._shard(key)
+            faiss_id = self._next_id[key]
+            self._next_id[key] += 1
+            shard.add_with_ids(
+                np.array(node.get_embedding(), dtype="float32")[np.newaxis, :],
+                np.array([faiss_id], dtype=np.int64),
+            )
+            for name in dict.fromkeys([filename, *(node.metadata.get(SOURCES_METADATA_KEY) or [])]):
+                self._files[key].setdefault(name, []).append(faiss_id)
+            if node.ref_doc_id:
+                self._ref_docs[node.ref_doc_id] = (key, filename)
+                self._doc_vectors.setdefault(node.ref_doc_id, []).append(faiss_id)
+            new_ids.append(f"{key}:{faiss_id}")
+        return new_ids
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """Remove every vector of a source document."""
+        if ref_doc_id not in self._ref_docs:
+            return
+        key, _ = self._ref_docs.pop(ref_doc_id)
+        ids = self._doc_vectors.pop(ref_doc_id, [])
+        if not ids:
+            return
+        # Other filenames may route to these vectors through provenance; drop them everywhere
+        removed = set(ids)
+        files = self._files[key]
+        for name in list(files):
+            files[name] = [i for i in files[name] if i not in removed]
+            if not files[name]:
+                del files[name]
+        self._shards[key].remove_ids(np.array(ids, dtype=np.int64))
+
+    def shard_filenames(self, key: str) -> List[str]:
+        """Filenames of the documents whose chunks are stored in a shard."""
+        return list(dict.fromkeys(filename for shard, filename in self._ref_docs.values() if shard == key))
+
+    def shard_stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            key: {"vectors": shard.ntotal, "documents": len(self.shard_filenames(key))}
+            for key, shard in sorted(self._shards.items())
+        }
+
+    def _routed_filenames(self, query: VectorStoreQuery) -> Optional[List[str]]:
+        """Filenames a query is restricted to by a filename filter, or None for all."""
+        if query.filters is None:
+            return None
+        filenames = None
+        for f in query.filters.filters:
+            if getattr(f, "key", None) != "filename":
+                raise ValueError("Only filename filters are supported by the sharded FAISS store.")
+            if f.operator == FilterOperator.EQ:
+                values = [f.value]
+            elif f.operator == FilterOperator.IN:
+                values = list(f.value)
+            else:
+                raise ValueError(f"Unsupported filename filter operator {f.operator}.")
+            filenames = values if filenames is None else [v for v in filenames if v in values]
+        return filenames
+
+    def _plan(self, filenames: Optional[List[str]]) -> List[Tuple[str, Optional[np.ndarray]]]:
+        """Shards to search, each with the FAISS IDs to restrict it to (None means the whole shard)."""
+        if filenames is None:
+            return [(key, None) for key, shard in self._shards.items() if shard.ntotal]
+
+        plan = []
+        for key, files in self._files.items():
+            # A chunk can be registered under several of the requested filenames
+            ids = list(dict.fromkeys(i for name in filenames for i in files.get(name, [])))
+            if not ids:
+                continue
+            if len(files) == len([name for name in filenames if name in files]):
+                # The shard holds nothing but the requested documents
+                plan.append((key, None))
+            else:
+                plan.append((key, np.array(ids, dtype=np.int64)))
+        return plan
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        query_np = np.array(query.query_embedding, dtype="float32")[np.newaxis, :]
+        plan = self._plan(self._routed_filenames(query))
+        k = query.similarity_top_k
+
+        def search(key: str, ids: Optional[np.ndarray]):
+            shard = self._shards[key]
+            if ids is None:
+                dists, indices = shard.search(query_np, min(k, shard.ntotal))
+            else:
+                params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(ids))
+                dists, indices = shard.search(query_np, min(k, len(ids)), params=params)
+            return [(float(d), f"{key}:{i}") for d, i in zip(dists[0], indices[0]) if i >= 0]
+
+        total = sum(self._shards[key].ntotal for key, _ in plan)
+        if len(plan) > 1 and total >= settings.PARALLEL_SEARCH_MIN_VECTORS:
+            per_shard = list(_get_search_pool().map(lambda item: search(*item), plan))
+        else:
+            # Small corpora search faster inline than through the thread pool
+            per_shard = [search(key, ids) for key, ids in plan]
+
+        merged = sorted((hit for hits in per_shard for hit in hits), key=lambda hit: hit[0])[:k]
+        return VectorStoreQueryResult(
+            similarities=[dist for dist, _ in merged],
+            ids=[vector_id for _, vector_id in merged],
+        )
+
+    def get_embeddings(self, ids: List[str]) -> np.ndarray:
+        """Reconstruct the stored vectors for vector IDs returned by query."""
+        vectors = []
+        for vector_id in ids:
+            key, faiss_id = vector_id.rsplit(":", 1)
+            vectors.append(self._shards[key].reconstruct(int(faiss_id)))
+        return np.vstack(vectors) if vectors else np.zeros((0, self.dimension), dtype="float32")
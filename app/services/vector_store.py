@@ -7,36 +7,82 @@ import shutil
 from typing import List, Optional, Dict, Any
 import logging
 
-from llama_index.core import VectorStoreIndex, Document, Settings
+from llama_index.core import VectorStoreIndex, Document, Settings, StorageContext
+from llama_index.core.data_structs import IndexDict
+from llama_index.core.storage.docstore import SimpleDocumentStore
 from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.response_synthesizers import get_response_synthesizer
+from llama_index.core.constants import DEFAULT_SIMILARITY_TOP_K
+from llama_index.core.schema import QueryBundle
+from llama_index.core.vector_stores.types import FilterOperator, MetadataFilter, MetadataFilters
 from llama_index.vector_stores.faiss import FaissVectorStore
 from llama_index.embeddings.gemini import GeminiEmbedding
 from llama_index.llms.groq import Groq
 from llama_index.llms.gemini import Gemini
+import httpx
 import pymupdf4llm
 
 from app.core.config import settings
+from app.services.dedup import deduplicate_nodes
+from app.services.retrieval import MMRRetriever, SynthesisLatencyModel
+from app.services.llm_router import LLMRouter, Provider
+from app.services.docstore import SQLiteDocumentStore
+from app.services.extraction_cache import ExtractionCache
+from app.services.artifact import ArtifactError, remove_manifest, verify_artifact
+from app.services.sharded_store import ShardedFaissVectorStore, shard_key_for
+from app.services.query_cache import LRUCache
+from app.services.embedding_batcher import EmbeddingBatcher, batch_query_embedder
+from app.services.concurrency import query_key
+from app.services.query_log import top_queries
+from app.services.ingestion import DeadLetterQueue, IngestionState, embed_with_retry, stable_node_id
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+class QueryStageError(Exception):
+    """Raised when a stage of a query (embedding, retrieval or synthesis) fails."""
+    
+    def __init__(self, stage: str, error: Exception):
+        super().__init__(str(error))
+        self.stage = stage
+        self.error = error
+
+
 class VectorStoreService:
-    """Service for managing the vector store."""
+    """
+    Service for managing the vector store.
     
-    def __init__(self):
+    serving=False gives the offline tools what they need to build an index (node parser,
+    embedding model, save and load) without creating LLM clients or loading the index.
+    """
+    
+    def __init__(self, serving: bool = True):
         self.index = None
         self.vector_store = None
         self.embed_model = None
         self.llm = None
+        self.dedup_stats = None
+        self.last_query_stats = None
+        self.synthesis_latency = SynthesisLatencyModel()
+        self.artifact_manifest = None
+        self.llm_router = self._build_llm_router()
+        # Opened on first PDF read: a load-only server never extracts and may run on a read-only filesystem
+        self._extraction_cache = None
+        self.embedding_cache = LRUCache(settings.EMBEDDING_CACHE_SIZE)
+        self.answer_cache = LRUCache(settings.ANSWER_CACHE_SIZE, ttl=settings.ANSWER_CACHE_TTL_SECONDS)
+        self.query_embedder = None
+        if settings.EMBED_BATCH_WINDOW_MS > 0:
+            self.query_embedder = EmbeddingBatcher(batch_query_embedder(lambda: self.embed_model))
         self.node_parser = SentenceSplitter(
-            chunk_size=512,  # Smaller chunks to avoid API size limits
-            chunk_overlap=50
+            chunk_size=settings.CHUNK_SIZE,  # Smaller chunks to avoid API size limits
+            chunk_overlap=settings.CHUNK_OVERLAP
         )
-        self.initialize_models()
+        self.initialize_models(llm=serving)
         
-        # Try to load existing index, create new one if it doesn't exist
-        self._initialize_index()
+        if serving:
+            # Try to load existing index, create new one if it doesn't exist
+            self._initialize_index()
     
     def _initialize_index(self):
         """Initialize index - load existing or create new if needed."""
@@ -46,6 +92,20 @@ class VectorStoreService:
         if loaded_index is not None:
             logger.info("Loaded existing vector index.")
             self.index = loaded_index
+            
+            # Finishing a build embeds and mutates the index, so it is left to the CLI rather than done on import
+            if IngestionState(settings.VECTOR_DB_PATH).status == "in_progress":
+                logger.warning("The index build was interrupted; run `python -m app.ingest --resume` to finish it.")
+            dead_letters = len(DeadLetterQueue(settings.VECTOR_DB_PATH))
+            if dead_letters:
+                logger.warning(f"{dead_letters} nodes failed to embed; run `python -m app.ingest --redrive` to retry them.")
+            return
+        
+        if settings.INDEX_LOAD_ONLY:
+            logger.error(
+                f"No usable vector index found in {settings.VECTOR_DB_PATH} and INDEX_LOAD_ONLY is set; "
+                "refusing to build. Run `python -m app.ingest` to build the index artifact."
+            )
             return
         
         # If no index exists, create a new one
@@ -63,6 +123,10 @@ class VectorStoreService:
         """Check if the index is loaded."""
         return self.index is not None
     
+    def supports_source_filters(self) -> bool:
+        """Whether queries can be restricted to source documents, which only the sharded store supports."""
+        return isinstance(self.vector_store, ShardedFaissVectorStore)
+    
     def is_index_on_disk(self) -> bool:
         """Check if the index exists on disk."""
         faiss_path = os.path.join(settings.VECTOR_DB_PATH, "faiss.index")
@@ -74,6 +138,10 @@ class VectorStoreService:
     def delete_index(self) -> bool:
         """Delete the index from disk."""
         try:
+            # Release the docstore file before removing it
+            if self.index is not None and isinstance(self.index.docstore, SQLiteDocumentStore):
+                self.index.docstore.kvstore.close()
+            
             if os.path.exists(settings.VECTOR_DB_PATH):
                 shutil.rmtree(settings.VECTOR_DB_PATH)
             
@@ -86,7 +154,7 @@ class VectorStoreService:
             logger.error(f"Error deleting index: {str(e)}")
             return False
     
-    def initialize_models(self):
+    def initialize_models(self, llm: bool = True):
         """Initialize embedding and LLM models."""
         # Initialize embedding model
         self.embed_model = GeminiEmbedding(
@@ -97,6 +165,9 @@ class VectorStoreService:
         # Configure global settings
         Settings.embed_model = self.embed_model
         
+        if not llm:
+            return
+        
         # Initialize default LLM - try Groq first, fall back to Gemini
         try:
             self.llm = Groq(api_key=settings.GROQ_API_KEY, model=settings.GROQ_MODEL)
@@ -109,9 +180,17 @@ class VectorStoreService:
             except Exception as e2:
                 logger.error(f"Failed to initialize any LLM. Please check your API keys. Error: {str(e2)}")
     
+    @property
+    def extraction_cache(self) -> Optional[ExtractionCache]:
+        if self._extraction_cache is None and settings.EXTRACTION_CACHE_ENABLED:
+            self._extraction_cache = ExtractionCache()
+        return self._extraction_cache
+    
     def read_pdf(self, file_path: str) -> str:
-        """Read PDF and convert to markdown."""
+        """Read PDF and convert to markdown, reusing cached extraction where possible."""
         try:
+            if self.extraction_cache is not None:
+                return self.extraction_cache.extract(file_path)
             return pymupdf4llm.to_markdown(file_path)
         except Exception as e:
             logger.error(f"Error reading {file_path}: {str(e)}")
@@ -136,144 +215,260 @@ class VectorStoreService:
             text = self.read_pdf(file_path)
             if text:
                 documents.append(Document(
+                    id_=os.path.basename(file_path),
                     text=text, 
                     metadata={"filename": os.path.basename(file_path)}
                 ))
         
+        if self._extraction_cache is not None:
+            logger.info(f"Extraction cache: {self._extraction_cache.stats()}")
+        
         return documents
     
+    def deduplicate(self, nodes: List) -> List:
+        """
+        Drop near-duplicate chunks so repeated boilerplate is embedded only once per shard.
+        
+        Chunks are compared only with chunks of the same shard, so rebuilding a shard
+        reproduces exactly what a full build stored in it and never strands a duplicate
+        whose keeper lives in another shard.
+        """
+        if not settings.DEDUP_ENABLED or not nodes:
+            return nodes
+        
+        groups: Dict[Optional[str], List] = {}
+        for node in nodes:
+            key = None if settings.VECTOR_SHARDING == "none" else shard_key_for(node.metadata.get("filename", "unknown"))
+            groups.setdefault(key, []).append(node)
+        
+        kept_nodes, stats = [], {}
+        for group in groups.values():
+            kept, group_stats = deduplicate_nodes(group)
+            kept_nodes.extend(kept)
+            for name, value in group_stats.items():
+                stats[name] = stats.get(name, 0) + value
+        self.dedup_stats = stats
+        logger.info(
+            f"Deduplication kept {stats['kept_nodes']}/{stats['input_nodes']} nodes "
+            f"({stats['duplicate_clusters']} duplicate clusters); saved "
+            f"{stats['embedding_calls_saved']} embedding calls and {stats['vectors_saved']} vectors"
+        )
+        return kept_nodes
+    
+    def _create_docstore(self, fresh: bool = False, path: str = None, read_only: bool = False):
+        """Create the configured docstore. A fresh SQLite docstore is emptied before use."""
+        if settings.DOCSTORE_BACKEND != "sqlite":
+            return SimpleDocumentStore()
+        
+        if path is None:
+            path = settings.VECTOR_DB_PATH
+        docstore = SQLiteDocumentStore(os.path.join(path, "docstore.sqlite"), read_only=read_only)
+        if fresh:
+            docstore.kvstore.clear()
+        return docstore
+    
+    def create_vector_store(self):
+        """Create an empty FAISS vector store, sharded according to VECTOR_SHARDING."""
+        if settings.VECTOR_SHARDING == "none":
+            faiss_index = faiss.IndexFlatL2(settings.EMBEDDING_DIMENSION)
+            return FaissVectorStore(faiss_index=faiss_index)
+        return ShardedFaissVectorStore()
+    
+    def _create_storage_context(self, path: str = None) -> StorageContext:
+        """Create an empty FAISS vector store and docstore for a new index."""
+        self.vector_store = self.create_vector_store()
+        return StorageContext.from_defaults(
+            vector_store=self.vector_store,
+            docstore=self._create_docstore(fresh=True, path=path)
+        )
+    
     def create_index(self, nodes, use_nodes=False) -> VectorStoreIndex:
         """Create a vector index from nodes or documents."""
-        # Create vector store
-        faiss_index = faiss.IndexFlatL2(settings.EMBEDDING_DIMENSION)
-        self.vector_store = FaissVectorStore(faiss_index=faiss_index)
+        # Create vector store and docstore
+        storage_context = self._create_storage_context()
         
         # Create and store index
         if use_nodes:
             self.index = VectorStoreIndex(
                 nodes=nodes,
-                vector_store=self.vector_store
+                storage_context=storage_context
             )
         else:
             self.index = VectorStoreIndex.from_documents(
                 nodes,  # In this case, nodes are actually documents
-                vector_store=self.vector_store
+                storage_context=storage_context
             )
         
         return self.index
     
-    def create_index_in_batches(self, documents: List[Document], batch_size: int = 2) -> VectorStoreIndex:
-        """Create a vector index from documents in batches to avoid memory issues."""
+    def split_documents(self, documents: List[Document]) -> List:
+        """Split documents into deduplicated nodes with IDs that are stable across runs."""
+        all_nodes = []
+        for doc in documents:
+            logger.info(f"Splitting document: {doc.metadata.get('filename', 'unknown')}")
+            # Split document into smaller chunks to avoid API size limits
+            nodes = self.node_parser.get_nodes_from_documents([doc])
+            for node in nodes:
+                node.id_ = stable_node_id(node)
+            all_nodes.extend(nodes)
+        
+        logger.info(f"Created {len(all_nodes)} nodes from {len(documents)} documents")
+        return self.deduplicate(all_nodes)
+    
+    def _index_nodes(self, nodes: List, state: IngestionState, dead_letters: DeadLetterQueue, batch_size: int, path: str):
+        """Embed and insert nodes batch by batch, saving after each batch and dead-lettering nodes that keep failing."""
+        total_batches = (len(nodes) + batch_size - 1) // batch_size
+        for i in range(0, len(nodes), batch_size):
+            batch = nodes[i:i+batch_size]
+            batch_num = (i // batch_size) + 1
+            logger.info(f"Processing batch {batch_num}/{total_batches} with {len(batch)} nodes...")
+            
+            embedded, failed, retried = embed_with_retry(batch, self.embed_model)
+            state.retried_nodes += retried
+            if embedded:
+                # Nodes already carry their embeddings, so inserting makes no API calls
+                self.index.insert_nodes(embedded)
+                state.indexed_nodes += len(embedded)
+            for node, error in failed:
+                logger.error(f"Node {node.node_id} from {node.metadata.get('filename', 'unknown')} failed: {error}")
+                dead_letters.add(node, error, settings.INGEST_MAX_ATTEMPTS)
+                state.failed_nodes += 1
+            
+            # Save after each batch to avoid losing progress
+            self.save_index(path)
+            state.save()
+            # Only once the batch is saved, so a crash before this point leaves it to be retried
+            dead_letters.remove(node.node_id for node in embedded)
+    
+    def indexed_node_ids(self) -> set:
+        """
+        IDs of the nodes whose vectors are in the index.
+        
+        Taken from the index struct rather than the docstore: the SQLite docstore commits on
+        insert, but the vectors only reach disk when the index is saved.
+        """
+        if self.index is None:
+            return set()
+        return set(self.index.index_struct.nodes_dict.values())
+    
+    def create_index_in_batches(self, documents: List[Document], batch_size: int = None, path: str = None) -> VectorStoreIndex:
+        """
+        Create a vector index from documents in batches, resuming an interrupted build.
+        
+        Each batch is embedded with retries; nodes that still fail go to the dead-letter list
+        instead of aborting the build, and nodes already in the index are never embedded again.
+        """
         if not documents:
             return None
         
+        if settings.INDEX_LOAD_ONLY:
+            logger.error("INDEX_LOAD_ONLY is set; refusing to build the index in the server process.")
+            return None
+        
+        batch_size = batch_size or settings.INGEST_BATCH_SIZE
+        path = path or settings.VECTOR_DB_PATH
+        state = IngestionState(path)
+        dead_letters = DeadLetterQueue(path)
+        
+        # The index on disk is about to be rebuilt in place and no longer matches any artifact manifest
+        remove_manifest(path)
+        
         try:
-            # Create a new FAISS index
-            faiss_index = faiss.IndexFlatL2(settings.EMBEDDING_DIMENSION)
+            if self.index is not None and state.status == "in_progress":
+                logger.info(f"Resuming interrupted index build ({state.indexed_nodes} nodes already indexed)")
+            else:
+                self.index = VectorStoreIndex(nodes=[], storage_context=self._create_storage_context(path))
+                dead_letters.clear()
+                state.reset()
+            state.status = "in_progress"
+            state.save()
             
-            # Create a vector store with the FAISS index
-            self.vector_store = FaissVectorStore(faiss_index=faiss_index)
+            all_nodes = self.split_documents(documents)
+            done_ids = self.indexed_node_ids() | {node.node_id for node in dead_letters.load()}
+            pending = [node for node in all_nodes if node.node_id not in done_ids]
+            logger.info(f"{len(all_nodes) - len(pending)} nodes already indexed or dead-lettered; {len(pending)} to embed")
             
-            # Process all documents by splitting them into smaller nodes first
-            all_nodes = []
-            for doc in documents:
-                logger.info(f"Splitting document: {doc.metadata.get('filename', 'unknown')}")
-                # Split document into smaller chunks to avoid API size limits
-                nodes = self.node_parser.get_nodes_from_documents([doc])
-                all_nodes.extend(nodes)
+            self._index_nodes(pending, state, dead_letters, batch_size, path)
             
-            logger.info(f"Created {len(all_nodes)} nodes from {len(documents)} documents")
-            
-            # Process nodes in small batches
-            total_nodes = len(all_nodes)
-            total_batches = (total_nodes + batch_size - 1) // batch_size
-            
-            # Initialize the index with the first batch
-            first_batch = all_nodes[:batch_size]
-            logger.info(f"Initializing index with first {len(first_batch)} nodes")
-            
-            # Create the initial index
-            self.index = VectorStoreIndex(
-                nodes=first_batch,
-                vector_store=self.vector_store
+            state.status = "complete"
+            state.save()
+            logger.info(
+                f"Indexed {state.indexed_nodes} nodes; {state.retried_nodes} retried, "
+                f"{state.failed_nodes} in the dead-letter list"
             )
-            
-            # Save the initial index
-            logger.info("Saving initial index...")
-            self.save_index()
-            
-            # Process the rest in batches
-            remaining_nodes = all_nodes[batch_size:]
-            
-            for i in range(0, len(remaining_nodes), batch_size):
-                batch = remaining_nodes[i:i+batch_size]
-                batch_num = (i // batch_size) + 1
-                
-                logger.info(f"Processing batch {batch_num}/{total_batches-1} with {len(batch)} nodes...")
-                
-                try:
-                    # Add nodes to the index
-                    for node in batch:
-                        self.index.insert_nodes([node])
-                    
-                    # Save after each batch to avoid losing progress
-                    logger.info(f"Saving progress after batch {batch_num}...")
-                    self.save_index()
-                    
-                    # Small delay to allow for resource cleanup
-                    time.sleep(0.5)
-                except Exception as batch_error:
-                    logger.error(f"Error processing batch {batch_num}: {str(batch_error)}")
-                    # Continue with next batch
-                    continue
-            
             return self.index
         except Exception as e:
-            logger.error(f"Error creating index in batches: {str(e)}")
-            # Try a simpler approach with even smaller batches if the batched approach fails
-            logger.info("Trying alternative approach with smaller chunks...")
-            try:
-                # Use an even smaller chunk size
-                self.node_parser = SentenceSplitter(
-                    chunk_size=256,
-                    chunk_overlap=20
-                )
-                
-                # Process all documents again with smaller chunks
-                all_nodes = []
-                for doc in documents:
-                    nodes = self.node_parser.get_nodes_from_documents([doc])
-                    all_nodes.extend(nodes)
-                
-                # Create a new FAISS index
-                faiss_index = faiss.IndexFlatL2(settings.EMBEDDING_DIMENSION)
-                self.vector_store = FaissVectorStore(faiss_index=faiss_index)
-                
-                # Process in very small batches
-                for i in range(0, len(all_nodes), 1):  # Process one node at a time
-                    node_batch = [all_nodes[i]]
-                    
-                    if i == 0:
-                        # Initialize index with first node
-                        self.index = VectorStoreIndex(
-                            nodes=node_batch,
-                            vector_store=self.vector_store
-                        )
-                    else:
-                        # Add node to existing index
-                        self.index.insert_nodes(node_batch)
-                    
-                    # Save more frequently
-                    if i % 5 == 0:
-                        self.save_index()
-                        time.sleep(0.5)
-                
-                # Final save
-                self.save_index()
-                return self.index
-            except Exception as e2:
-                logger.error(f"Error creating index with alternative approach: {str(e2)}")
-                return None
+            # Progress is saved per batch and the state stays in_progress, so the next run resumes from here
+            logger.error(f"Error creating index in batches: {str(e)}. Progress kept; rerun to resume.")
+            return self.index
+    
+    def redrive_dead_letters(self, path: str = None) -> int:
+        """Retry dead-lettered nodes, inserting those that now succeed. Returns how many remain failed."""
+        if path is None:
+            path = settings.VECTOR_DB_PATH
+        if self.index is None:
+            return 0
+        
+        state = IngestionState(path)
+        dead_letters = DeadLetterQueue(path)
+        nodes = dead_letters.load()
+        if not nodes:
+            return 0
+        
+        logger.info(f"Re-driving {len(nodes)} dead-lettered nodes...")
+        remove_manifest(path)
+        # Entries leave the list batch by batch as they are saved into the index, so a crash loses none
+        self._index_nodes(nodes, state, dead_letters, settings.INGEST_BATCH_SIZE, path)
+        state.failed_nodes = len(dead_letters)
+        state.save()
+        logger.info(f"Re-drive finished; {state.failed_nodes} nodes still failing")
+        return state.failed_nodes
+    
+    def rebuild_shard(self, key: str, path: str = None) -> int:
+        """
+        Re-index the documents of one shard from the data folder, leaving other shards untouched.
+        
+        Returns the number of nodes indexed into the shard.
+        """
+        if path is None:
+            path = settings.VECTOR_DB_PATH
+        if self.index is None or not isinstance(self.vector_store, ShardedFaissVectorStore):
+            raise ValueError("Shard rebuilds need a loaded sharded index.")
+        
+        # Drop what the shard holds now, including documents since removed from the data folder.
+        # The index struct maps vector IDs to node IDs, which differ here, so it is pruned by value.
+        docstore = self.index.docstore
+        nodes_dict = self.index.index_struct.nodes_dict
+        for filename in self.vector_store.shard_filenames(key):
+            self.vector_store.delete(filename)
+            ref_doc_info = docstore.get_ref_doc_info(filename)
+            node_ids = set(ref_doc_info.node_ids) if ref_doc_info else set()
+            for vector_id in [v for v, node_id in nodes_dict.items() if node_id in node_ids]:
+                del nodes_dict[vector_id]
+            docstore.delete_ref_doc(filename, raise_error=False)
+        self.index.storage_context.index_store.add_index_struct(self.index.index_struct)
+        
+        pdf_files = glob.glob(f"{settings.DATA_DIR}/*.pdf")
+        documents = []
+        for file_path in pdf_files:
+            filename = os.path.basename(file_path)
+            if shard_key_for(filename, self.vector_store.mode, self.vector_store.shard_count) != key:
+                continue
+            text = self.read_pdf(file_path)
+            if text:
+                documents.append(Document(id_=filename, text=text, metadata={"filename": filename}))
+        
+        state = IngestionState(path)
+        remove_manifest(path)
+        nodes = self.split_documents(documents)
+        indexed_before = state.indexed_nodes
+        self._index_nodes(nodes, state, DeadLetterQueue(path), settings.INGEST_BATCH_SIZE, path)
+        logger.info(f"Rebuilt shard {key} from {len(documents)} documents")
+        return state.indexed_nodes - indexed_before
+    
+    def ingestion_status(self) -> dict:
+        """Counters of the last index build."""
+        return IngestionState(settings.VECTOR_DB_PATH).to_dict()
     
     def save_index(self, path: str = None) -> bool:
         """Save the index to disk."""
@@ -311,18 +506,9 @@ class VectorStoreService:
                     faiss_path = os.path.join(path, "faiss.index")
                     faiss.write_index(faiss_index, faiss_path)
                     
-                    # Save the metadata
-                    metadata_dict = {}
-                    try:
-                        metadata_dict = self.vector_store._metadata_dict
-                    except (AttributeError, KeyError):
-                        try:
-                            metadata_dict = self.index._vector_store._metadata_dict
-                        except (AttributeError, KeyError):
-                            metadata_dict = self.index._storage_context.vector_store._metadata_dict
-                    
+                    # Save the index structure; it holds only node IDs, the text lives in the docstore
                     with open(os.path.join(path, "index_metadata.pkl"), "wb") as f:
-                        pickle.dump(metadata_dict, f)
+                        pickle.dump(self.index.index_struct, f)
                     
                     logger.info("Successfully saved index components")
                     return True
@@ -333,10 +519,26 @@ class VectorStoreService:
             logger.error(f"Error saving index: {str(e)}")
             return False
     
-    def load_index(self, path: str = None) -> Optional[VectorStoreIndex]:
-        """Load the index from disk."""
+    def load_index(self, path: str = None, read_only: bool = None) -> Optional[VectorStoreIndex]:
+        """
+        Load the index from disk.
+        
+        The SQLite docstore is opened read-only when read_only is set, by default when
+        INDEX_LOAD_ONLY is; the server can then run from a read-only filesystem.
+        """
         if path is None:
             path = settings.VECTOR_DB_PATH
+        if read_only is None:
+            read_only = settings.INDEX_LOAD_ONLY
+        
+        # Verify artifacts built by `python -m app.ingest` before trusting them
+        try:
+            self.artifact_manifest = verify_artifact(path)
+        except ArtifactError as e:
+            logger.error(f"Refusing to load index artifact from {path}: {str(e)}")
+            return None
+        if self.artifact_manifest is not None:
+            logger.info(f"Loading index artifact version {self.artifact_manifest['version']}")
         
         # Try loading the full index first
         full_index_path = os.path.join(path, "full_index.pkl")
@@ -349,6 +551,9 @@ class VectorStoreService:
                         self.vector_store = self.index._vector_store
                     except AttributeError:
                         self.vector_store = self.index._storage_context.vector_store
+                    # The docstore lives next to the pickle, wherever the artifact was built
+                    if isinstance(self.index.docstore, SQLiteDocumentStore):
+                        self.index.docstore.kvstore.relocate(os.path.join(path, "docstore.sqlite"), read_only=read_only)
                     return self.index
             except Exception as e:
                 logger.error(f"Error loading full index: {str(e)}. Trying component-based loading...")
@@ -366,31 +571,177 @@ class VectorStoreService:
             
             # Load the metadata
             with open(metadata_path, "rb") as f:
-                metadata_dict = pickle.load(f)
+                metadata = pickle.load(f)
             
             # Create the vector store
-            self.vector_store = FaissVectorStore(
-                faiss_index=faiss_index,
-                metadata_dict=metadata_dict
-            )
+            self.vector_store = FaissVectorStore(faiss_index=faiss_index)
             
-            # Create the index
-            self.index = VectorStoreIndex.from_vector_store(self.vector_store)
+            # Create the index, reattaching the on-disk docstore when the node IDs were saved
+            if isinstance(metadata, IndexDict):
+                storage_context = StorageContext.from_defaults(
+                    vector_store=self.vector_store,
+                    docstore=self._create_docstore(path=path, read_only=read_only)
+                )
+                self.index = VectorStoreIndex(index_struct=metadata, storage_context=storage_context)
+            else:
+                self.index = VectorStoreIndex.from_vector_store(self.vector_store)
             
             return self.index
         except Exception as e:
             logger.error(f"Error loading index: {str(e)}")
             return None
     
-    def query(self, query_text: str, chat_history: List[Dict[str, str]] = None) -> str:
-        """Query the index."""
+    def _build_llm_router(self) -> LLMRouter:
+        """Create the provider router: Groq first, Gemini second, each with its own breaker and stats."""
+        def groq():
+            # Retries are left to the router so they can't run past the deadline; the shared
+            # HTTP client keeps connections pooled across the per-request copies below
+            return Groq(api_key=settings.GROQ_API_KEY, model=settings.GROQ_MODEL, max_retries=0, http_client=httpx.Client())
+        
+        def groq_with_timeout(llm: Groq, timeout: float) -> Groq:
+            # Extra kwargs are passed through to the request, so the timeout applies to this call only
+            return llm.model_copy(update={"additional_kwargs": {**llm.additional_kwargs, "timeout": timeout}})
+        
+        def gemini():
+            return Gemini(model=settings.GEMINI_MODEL, api_key=settings.GOOGLE_API_KEY)
+        
+        def gemini_with_timeout(llm: Gemini, timeout: float) -> Gemini:
+            # The copy shares the underlying model; only its request options differ
+            call = llm.model_copy()
+            call._request_options = {"timeout": timeout}
+            return call
+        
+        return LLMRouter([
+            Provider("groq", groq, groq_with_timeout),
+            Provider("gemini", gemini, gemini_with_timeout),
+        ])
+    
+    def _run_query(
+        self,
+        full_query: str,
+        top_k: int = None,
+        candidate_pool: int = None,
+        token_budget: int = None,
+        deadline: float = None,
+        sources: List[str] = None,
+        stats: Dict[str, Any] = None
+    ) -> str:
+        """Retrieve diversified context within the token budget and synthesize an answer through the LLM router."""
+        deadline = deadline or settings.LLM_DEADLINE_SECONDS
+        start = time.perf_counter()
+        
+        filters = None
+        if sources:
+            # The sharded store routes filename filters to the shards holding those documents
+            filters = MetadataFilters(filters=[MetadataFilter(key="filename", operator=FilterOperator.IN, value=sources)])
+        
+        # Retrieve once; only synthesis is routed (and possibly hedged) across providers
+        retriever = MMRRetriever(
+            self.index,
+            top_k=top_k,
+            candidate_pool=candidate_pool,
+            token_budget=token_budget,
+            filters=filters
+        )
+        try:
+            embedding = self.embed_query(full_query, timeout=deadline)
+        except Exception as e:
+            raise QueryStageError("embedding", e)
+        embedded = time.perf_counter()
+        try:
+            nodes = retriever.retrieve(QueryBundle(full_query, embedding=embedding))
+        except Exception as e:
+            raise QueryStageError("retrieval", e)
+        retrieved = time.perf_counter()
+        
+        def synthesize(llm) -> str:
+            synthesizer = get_response_synthesizer(llm=llm, response_mode="compact")
+            return str(synthesizer.synthesize(full_query, nodes))
+        
+        try:
+            response = self.llm_router.call(synthesize, deadline=max(0.1, deadline - (retrieved - start)))
+        except Exception as e:
+            raise QueryStageError("synthesis", e)
+        finished = time.perf_counter()
+        
+        query_stats = dict(retriever.last_stats)
+        query_stats["embedding_seconds"] = embedded - start
+        query_stats["retrieval_seconds"] = retrieved - embedded
+        query_stats["synthesis_seconds"] = finished - retrieved
+        query_stats["total_seconds"] = finished - start
+        self.synthesis_latency.observe(query_stats.get("context_tokens", 0), query_stats["synthesis_seconds"])
+        seconds_per_token = self.synthesis_latency.seconds_per_token()
+        if seconds_per_token is not None:
+            query_stats["synthesis_seconds_saved"] = seconds_per_token * query_stats.get("prompt_tokens_saved", 0)
+        self.last_query_stats = query_stats
+        if stats is not None:
+            stats.update(query_stats)
+        logger.info(
+            f"Context: {query_stats.get('selected', 0)}/{query_stats.get('candidates', 0)} chunks, "
+            f"{query_stats.get('context_tokens', 0)} tokens ({query_stats.get('prompt_tokens_saved', 0)} saved vs the previous top-{DEFAULT_SIMILARITY_TOP_K}); "
+            f"synthesis took {query_stats['synthesis_seconds']:.2f}s"
+            + (f", an estimated {query_stats['synthesis_seconds_saved']:.2f}s saved" if "synthesis_seconds_saved" in query_stats else "")
+        )
+        return response
+    
+    def query(
+        self,
+        query_text: str,
+        chat_history: List[Dict[str, str]] = None,
+        top_k: int = None,
+        candidate_pool: int = None,
+        token_budget: int = None,
+        deadline: float = None,
+        sources: List[str] = None,
+        stats: Dict[str, Any] = None
+    ) -> str:
+        """
+        Query the index, optionally restricted to the given source filenames.
+        
+        Per-stage timings and the outcome ("ok", "cached" or "error") are written into stats when given.
+        """
+        stats = {} if stats is None else stats
         if self.index is None:
             # Try to initialize the index one more time
             self._initialize_index()
             
             if self.index is None:
+                stats["status"] = "error"
                 return "Index not loaded. Please create or load an index first."
         
+        full_query = self._full_query(query_text, chat_history)
+        
+        # Answers depend on the whole conversation, so only history-free queries are cached
+        answer_key = None
+        if settings.ANSWER_CACHE_ENABLED and not chat_history:
+            answer_key = self._answer_key(query_text, top_k, candidate_pool, token_budget, sources)
+            cached = self.answer_cache.get(answer_key)
+            if cached is not None:
+                stats["status"] = "cached"
+                return cached
+        
+        try:
+            response = self._run_query(full_query, top_k, candidate_pool, token_budget, deadline, sources, stats)
+        except QueryStageError as e:
+            stats["status"] = "error"
+            stats["failed_stage"] = e.stage
+            if e.stage == "synthesis":
+                logger.error(f"Query failed during synthesis: {str(e)}. Provider status: {self.llm_router.stats()}")
+                return f"All LLM providers failed. Error: {str(e)}"
+            logger.error(f"Query failed during {e.stage}: {str(e)}")
+            return f"Query failed during {e.stage}. Error: {str(e)}"
+        except Exception as e:
+            logger.error(f"Query failed: {str(e)}")
+            stats["status"] = "error"
+            return f"Query failed. Error: {str(e)}"
+        
+        stats["status"] = "ok"
+        if answer_key is not None:
+            self.answer_cache.put(answer_key, response)
+        return response
+    
+    def _full_query(self, query_text: str, chat_history: List[Dict[str, str]] = None) -> str:
+        """Combine the system prompt, recent conversation and the new question into the retrieval and synthesis query."""
         # Build context from recent messages
         context_str = ""
         if chat_history:
@@ -400,24 +751,74 @@ class VectorStoreService:
                     context_str += f"### Previous Interaction:\n**User**: {recent[i]['content']}\n**Assistant**: {recent[i+1]['content']}\n\n"
         
         # Combine system prompt, context, and current question
-        full_query = f"{settings.SYSTEM_PROMPT}\n\n{context_str}\n### New Question:\n{query_text}"
+        return f"{settings.SYSTEM_PROMPT}\n\n{context_str}\n### New Question:\n{query_text}"
+    
+    def _answer_key(self, query_text: str, top_k: int, candidate_pool: int, token_budget: int, sources: List[str]) -> str:
+        # The node count changes whenever the index is rebuilt or extended, retiring old answers
+        index_size = len(self.index.index_struct.nodes_dict) if self.index is not None else 0
+        return query_key(" ".join(query_text.lower().split()), top_k, candidate_pool, token_budget, sources, index_size)
+    
+    def embed_query(self, full_query: str, timeout: float = None) -> List[float]:
+        """Embed a query, reusing the embedding of an identical recent query."""
+        return self.embed_queries([full_query], timeout)[0]
+    
+    def embed_queries(self, full_queries: List[str], timeout: float = None) -> List[List[float]]:
+        """
+        Embed queries, sharing one embedding request with other concurrent queries when batching is enabled.
         
-        # Try Groq first, fall back to Gemini
-        try:
-            Settings.llm = Groq(api_key=settings.GROQ_API_KEY, model=settings.GROQ_MODEL)
-            query_engine = self.index.as_query_engine(response_mode="compact")
-            response = query_engine.query(full_query)
-            return str(response)
-        except Exception as e:
-            logger.warning(f"Groq query failed: {str(e)}. Falling back to Gemini.")
+        With batching, waiting for the batch gives up after timeout seconds.
+        """
+        embeddings = [self.embedding_cache.get(q) for q in full_queries]
+        missing = [q for q, embedding in zip(full_queries, embeddings) if embedding is None]
+        if missing:
+            if self.query_embedder is not None:
+                computed = self.query_embedder.embed_many(missing, timeout)
+            else:
+                computed = [self.embed_model.get_query_embedding(q) for q in missing]
+            for q, embedding in zip(missing, computed):
+                self.embedding_cache.put(q, embedding)
+            by_query = dict(zip(missing, computed))
+            embeddings = [by_query[q] if embedding is None else embedding for q, embedding in zip(full_queries, embeddings)]
+        return embeddings
+    
+    def warm_caches(self, limit: int = None, answers: bool = None, path: str = None) -> int:
+        """
+        Pre-warm the embedding cache, and optionally the answer cache, from the most frequent logged queries.
+        
+        Returns the number of queries warmed.
+        """
+        limit = settings.QUERY_WARMUP_QUERIES if limit is None else limit
+        answers = (settings.QUERY_WARMUP_ANSWERS if answers is None else answers) and settings.ANSWER_CACHE_ENABLED
+        if limit <= 0 or self.index is None:
+            return 0
+        
+        queries = top_queries(path, limit)
+        warmed = 0
+        if answers:
+            for query_text, options, count in queries:
+                try:
+                    self.query(query_text, **options)
+                    warmed += 1
+                except Exception as e:
+                    logger.warning(f"Could not warm cache for a logged query: {str(e)}")
+        elif queries:
+            # Embedded together, so warm-up costs a few batch requests rather than one per query
             try:
-                Settings.llm = Gemini(model=settings.GEMINI_MODEL, api_key=settings.GOOGLE_API_KEY)
-                query_engine = self.index.as_query_engine(response_mode="compact")
-                response = query_engine.query(full_query)
-                return str(response)
-            except Exception as e2:
-                logger.error(f"Both Groq and Gemini failed. Error: {str(e2)}")
-                return f"Both Groq and Gemini failed. Error: {str(e2)}"
+                warmed = len(self.embed_queries([self._full_query(query_text) for query_text, _, _ in queries]))
+            except Exception as e:
+                logger.warning(f"Could not warm the embedding cache: {str(e)}")
+        logger.info(f"Warmed caches with {warmed} frequent queries (answers: {answers})")
+        return warmed
+
+# Singleton instance, created on first import of `vector_store_service` so the offline tools
+# can import this module without loading the index or creating LLM clients
+_vector_store_service = None
+
 
-# Singleton instance
-vector_store_service = VectorStoreService()
+def __getattr__(name: str):
+    global _vector_store_service
+    if name != "vector_store_service":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if _vector_store_service is None:
+        _vector_store_service = VectorStoreService()
+    return _vector_store_service
@@ -0,0 +1,70 @@
+import numpy as np
+from llama_index.core.schema import TextNode
+
+from app.services.dedup import (
+    SOURCES_METADATA_KEY,
+    MinHashDeduplicator,
+    _mod_mersenne,
+    _mulmod,
+    deduplicate_nodes,
+)
+
+PRIME = (1 << 61) - 1
+MASK = (1 << 32) - 1
+
+
+def test_mod_mersenne_matches_python_integers():
+    rng = np.random.RandomState(0)
+    values = [0, 1, PRIME - 1, PRIME, PRIME + 1, 2 * PRIME, (1 << 64) - 1]
+    values += [int(v) for v in rng.randint(0, np.iinfo(np.int64).max, size=200, dtype=np.int64)]
+    reduced = _mod_mersenne(np.array(values, dtype=np.uint64))
+    assert [int(r) for r in reduced] == [v % PRIME for v in values]
+
+
+def test_mulmod_matches_python_integers():
+    rng = np.random.RandomState(1)
+    a = [1, PRIME - 1, (1 << 32) - 1, 1 << 32] + [int(v) % PRIME for v in rng.randint(1, np.iinfo(np.int64).max, size=50, dtype=np.int64)]
+    x = [0, 1, MASK] + [int(v) for v in rng.randint(0, MASK, size=50, dtype=np.int64)]
+    products = _mulmod(np.array(a, dtype=np.uint64)[:, None], np.array(x, dtype=np.uint64)[None, :])
+    expected = [[(ai * xi) % PRIME for xi in x] for ai in a]
+    assert products.astype(object).tolist() == expected
+
+
+def test_signature_matches_python_reference():
+    dedup = MinHashDeduplicator(num_perm=32, shingle_size=3)
+    text = "Fibre broadband reaches rural areas through shared ducts and poles in most regions."
+    shingles = [int(s) for s in dedup._shingles(text)]
+    expected = [
+        min(((int(a) * x + int(b)) % PRIME) & MASK for x in shingles)
+        for a, b in zip(dedup._a, dedup._b)
+    ]
+    assert [int(v) for v in dedup.signature(text)] == expected
+
+
+def test_bucket_mates_are_compared_with_each_other_not_only_the_first():
+    # All three share band 0; only the last two are similar, and they share no other band
+    signatures = {
+        "a": np.array([0, 0, 0, 0, 5, 5, 5, 5], dtype=np.uint64),
+        "b": np.array([0, 0, 0, 0, 1, 2, 3, 4], dtype=np.uint64),
+        "c": np.array([0, 0, 0, 0, 1, 2, 3, 9], dtype=np.uint64),
+    }
+    dedup = MinHashDeduplicator(threshold=0.7, num_perm=8)
+    dedup.bands, dedup.rows = 2, 4
+    dedup.signature = signatures.__getitem__
+
+    assert dedup.find_clusters(["a", "b", "c"]) == [[0], [1, 2]]
+
+
+def test_duplicates_keep_the_first_node_with_every_source():
+    shared = "Latency on satellite links is dominated by the distance to geostationary orbit. " * 4
+    nodes = [
+        TextNode(text=shared, metadata={"filename": "a.pdf"}),
+        TextNode(text="Mobile coverage maps are published by the national regulator every quarter.", metadata={"filename": "a.pdf"}),
+        TextNode(text=shared, metadata={"filename": "b.pdf"}),
+    ]
+
+    kept, stats = deduplicate_nodes(nodes, MinHashDeduplicator())
+    assert kept == [nodes[0], nodes[1]]
+    assert nodes[0].metadata[SOURCES_METADATA_KEY] == ["a.pdf", "b.pdf"]
+    assert SOURCES_METADATA_KEY in nodes[0].excluded_embed_metadata_keys
+    assert stats["duplicate_nodes"] == 1
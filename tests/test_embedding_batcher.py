@@ -0,0 +1,82 @@
+import time
+import threading
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+import pytest
+
+from app.services.embedding_batcher import EmbeddingBatcher
+
+
+class FakeBackend:
+    """Local stand-in for a batch embedding call that can be slowed down, broken or made to drop vectors."""
+
+    def __init__(self, delay: float = 0.0, error: Exception = None, drop: int = 0):
+        self.delay = delay
+        self.error = error
+        self.drop = drop
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self._lock:
+            self.batches.append(list(texts))
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return [[float(len(text))] for text in texts][:len(texts) - self.drop]
+
+
+def test_concurrent_texts_share_one_batch_and_duplicates_are_embedded_once():
+    backend = FakeBackend()
+    batcher = EmbeddingBatcher(backend, max_wait_ms=50, max_batch_size=8, max_concurrent_batches=1)
+
+    assert batcher.embed_many(["a", "bb", "a"], timeout=2.0) == [[1.0], [2.0], [1.0]]
+    assert backend.batches == [["a", "bb"]]
+
+
+def test_backend_error_fails_every_caller_of_the_batch():
+    batcher = EmbeddingBatcher(FakeBackend(error=RuntimeError("quota exceeded")), max_wait_ms=20)
+
+    futures = [batcher.submit(text) for text in ("a", "b")]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="quota exceeded"):
+            future.result(timeout=2.0)
+
+
+def test_short_backend_response_fails_callers_instead_of_hanging():
+    batcher = EmbeddingBatcher(FakeBackend(drop=1), max_wait_ms=20)
+
+    futures = [batcher.submit(text) for text in ("a", "b")]
+    for future in futures:
+        with pytest.raises(ValueError, match="1 vectors for 2 texts"):
+            future.result(timeout=2.0)
+
+
+def test_collector_survives_a_batch_that_cannot_be_dispatched():
+    batcher = EmbeddingBatcher(FakeBackend(), max_wait_ms=5)
+    batcher._start()
+    real_executor = batcher._executor
+
+    class BrokenExecutor:
+        def submit(self, *args):
+            raise RuntimeError("executor shut down")
+
+    batcher._executor = BrokenExecutor()
+    with pytest.raises(RuntimeError, match="executor shut down"):
+        batcher.embed("a", timeout=2.0)
+
+    batcher._executor = real_executor
+    assert batcher.embed("bb", timeout=2.0) == [2.0]
+
+
+def test_timeout_is_raised_and_unsent_texts_are_dropped():
+    backend = FakeBackend(delay=0.3)
+    batcher = EmbeddingBatcher(backend, max_wait_ms=0, max_batch_size=1, max_concurrent_batches=1)
+
+    start = time.monotonic()
+    with pytest.raises(FuturesTimeoutError, match="within 0.1s"):
+        batcher.embed_many(["a", "b", "c"], timeout=0.1)
+    assert time.monotonic() - start < 0.25
+
+    time.sleep(0.4)
+    assert backend.batches == [["a"]]
@@ -0,0 +1,159 @@
+import time
+import threading
+
+import pytest
+
+from app.services.llm_router import (
+    CircuitBreaker,
+    DeadlineExceeded,
+    LLMRouter,
+    NoProviderAvailable,
+    Provider,
+)
+
+
+class FakeLLM:
+    """Local stand-in for an LLM client that answers after a delay or raises."""
+
+    def __init__(self, name: str, delay: float = 0.0, error: Exception = None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.builds = 0
+        self.timeouts = []
+        self._lock = threading.Lock()
+
+    def build(self) -> "FakeLLM":
+        with self._lock:
+            self.builds += 1
+        return self
+
+    def with_timeout(self, client: "FakeLLM", timeout: float) -> "FakeLLM":
+        with self._lock:
+            self.timeouts.append(timeout)
+        return client
+
+    def complete(self) -> str:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.name
+
+
+def provider(fake: FakeLLM, failure_threshold: int = 3, cooldown: float = 30.0) -> Provider:
+    return Provider(fake.name, fake.build, fake.with_timeout, window=20, breaker=CircuitBreaker(failure_threshold, 0.5, cooldown))
+
+
+def ask(llm: FakeLLM) -> str:
+    return llm.complete()
+
+
+def test_fastest_provider_answers_without_hedging():
+    primary = FakeLLM("primary", delay=0.01)
+    secondary = FakeLLM("secondary", delay=0.01)
+    router = LLMRouter([provider(primary), provider(secondary)], hedge_after=1.0)
+
+    assert router.call(ask, deadline=2.0) == "primary"
+    assert secondary.calls == 0
+    assert router.hedged == 0
+
+
+def test_slow_provider_is_hedged_and_first_answer_wins():
+    slow = FakeLLM("slow", delay=0.5)
+    fast = FakeLLM("fast", delay=0.01)
+    router = LLMRouter([provider(slow), provider(fast)], hedge_after=0.05)
+
+    start = time.monotonic()
+    assert router.call(ask, deadline=2.0) == "fast"
+    assert time.monotonic() - start < 0.4
+    assert router.hedged == 1
+
+
+def test_failing_provider_falls_back_to_the_next():
+    broken = FakeLLM("broken", error=RuntimeError("503 from upstream"))
+    healthy = FakeLLM("healthy", delay=0.01)
+    router = LLMRouter([provider(broken), provider(healthy)], hedge_after=0)
+
+    assert router.call(ask, deadline=2.0) == "healthy"
+    assert broken.calls == 1
+
+
+def test_failed_provider_is_ranked_after_a_healthy_one():
+    broken = FakeLLM("broken", error=RuntimeError("503 from upstream"))
+    healthy = FakeLLM("healthy")
+    router = LLMRouter([provider(broken), provider(healthy)], hedge_after=0)
+
+    for _ in range(3):
+        assert router.call(ask, deadline=2.0) == "healthy"
+    assert broken.calls == 1
+
+
+def test_breaker_opens_and_calls_are_refused_without_reaching_the_provider():
+    broken = FakeLLM("broken", error=RuntimeError("503 from upstream"))
+    router = LLMRouter([provider(broken, failure_threshold=2)], hedge_after=0)
+
+    for _ in range(2):
+        with pytest.raises(NoProviderAvailable, match="503"):
+            router.call(ask, deadline=1.0)
+    with pytest.raises(NoProviderAvailable, match="circuits are open"):
+        router.call(ask, deadline=1.0)
+
+    assert broken.calls == 2
+    assert router.stats()["providers"]["broken"]["state"] == CircuitBreaker.OPEN
+
+
+def test_breaker_half_opens_after_cooldown():
+    flaky = FakeLLM("flaky", error=RuntimeError("timeout"))
+    router = LLMRouter([provider(flaky, failure_threshold=1, cooldown=0.05)], hedge_after=0)
+
+    with pytest.raises(NoProviderAvailable):
+        router.call(ask, deadline=1.0)
+    with pytest.raises(NoProviderAvailable):
+        router.call(ask, deadline=1.0)
+    assert flaky.calls == 1
+
+    time.sleep(0.06)
+    flaky.error = None
+    assert router.call(ask, deadline=1.0) == "flaky"
+    assert router.stats()["providers"]["flaky"]["state"] == CircuitBreaker.CLOSED
+
+
+def test_deadline_expires_when_no_provider_answers_in_time():
+    slow = FakeLLM("slow", delay=0.5)
+    slower = FakeLLM("slower", delay=0.5)
+    router = LLMRouter([provider(slow), provider(slower)], hedge_after=0.05)
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        router.call(ask, deadline=0.2)
+    assert time.monotonic() - start < 0.4
+
+
+def test_remaining_deadline_is_passed_to_the_client():
+    fake = FakeLLM("only")
+    router = LLMRouter([provider(fake)], hedge_after=0)
+
+    router.call(ask, deadline=1.5)
+    assert 1.0 < fake.timeouts[0] <= 1.5
+
+
+def test_client_is_built_once_and_reused_with_each_call_timeout():
+    fake = FakeLLM("only")
+    router = LLMRouter([provider(fake)], hedge_after=0)
+
+    router.call(ask, deadline=1.5)
+    router.call(ask, deadline=0.5)
+    assert fake.builds == 1
+    assert fake.timeouts[1] <= 0.5 < fake.timeouts[0]
+
+
+def test_all_providers_failing_raises_with_the_last_error():
+    first = FakeLLM("first", error=RuntimeError("quota exceeded"))
+    second = FakeLLM("second", error=RuntimeError("bad gateway"))
+    router = LLMRouter([provider(first), provider(second)], hedge_after=0)
+
+    with pytest.raises(NoProviderAvailable, match="bad gateway"):
+        router.call(ask, deadline=1.0)